@@ -1,18 +1,15 @@
 # debug_vector_inspect.py
-from src.common import getChromaByPropertyCode
+from src.common import getVectorStore
 
 property_code = "AC32AW"
 collection_name = "annual_summary"
 
-chroma = getChromaByPropertyCode(property_code, collection_name)
-print("📚 Collection Info:", chroma._collection.count(), "documents")
+store = getVectorStore(property_code, collection_name)
+print("📚 Collection Info:", store.name, store.count(), "documents")
 
-res = chroma._collection.get(
-    limit=5,
-    include=["documents", "metadatas"]
-)
+res = store.get(include=["documents", "metadatas"])
 
-for i, (doc, meta) in enumerate(zip(res["documents"], res["metadatas"]), start=1):
+for i, (doc, meta) in enumerate(zip(res["documents"][:5], res["metadatas"][:5]), start=1):
     print(f"\n--- Doc {i} ---")
     print("Metadata:", meta)
     print("Content:", doc[:500])
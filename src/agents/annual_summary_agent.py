@@ -2,11 +2,11 @@ from __future__ import annotations
 import os, re, json, calendar
 from typing import Dict, Any, List, Tuple, Optional
 from langchain_openai import ChatOpenAI
-from langchain_chroma import Chroma
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.documents import Document
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from ..common import getChromaByPropertyCode
+from ..common import getVectorStore
+from ..vector_store import VectorStore
 from utils.logger import get_custom_logger
 
 logger = get_custom_logger("annual_summary_agent")
@@ -54,9 +54,9 @@ def _parse_month_year(text: str) -> Tuple[Optional[int], Optional[int]]:
     return month, year
 
 
-def _get_all_year_docs(vs: Chroma, year: int) -> list[Document]:
+def _get_all_year_docs(vs: VectorStore, year: int) -> list[Document]:
     """Retrieve all documents for a given year and convert them into LangChain Document objects."""
-    res = vs._collection.get(where={"year": {"$eq": year}}, include=["documents", "metadatas"])
+    res = vs.get(where={"year": {"$eq": year}}, include=["documents", "metadatas"])
     if not res or not res.get("documents"):
         return []
 
@@ -82,7 +82,7 @@ def agent_handle(user_question: str, propertyCode: str,
         month, year = _parse_month_year(user_question)
         year = year or default_year
 
-        vs = getChromaByPropertyCode(propertyCode, "annual_summary", f"./{propertyCode}")
+        vs = getVectorStore(propertyCode, "annual_summary", f"./{propertyCode}")
 
         if not year:
             return {
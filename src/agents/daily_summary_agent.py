@@ -1,5 +1,5 @@
 # src/agents/daily_summary_agent.py
-from src.common import llm, SYSTEM_PREFIX, JSON_SCHEMA_INSTRUCTION, getChromaByPropertyCode
+from src.common import llm, SYSTEM_PREFIX, JSON_SCHEMA_INSTRUCTION, getVectorStore
 from src.db_utils import fetch_one
 import json
 from langchain.schema import HumanMessage
@@ -57,7 +57,7 @@ def parse_staydate(text: str) -> str | None:
 
 def agent_handle(user_question,propertyCode: str="", AsOfDate: str=""):
     print("Start agent script........")
-    chroma = getChromaByPropertyCode(propertyCode,collection_name="daily_summaries")
+    chroma = getVectorStore(propertyCode, collection_name="daily_summaries")
  
     flt = {"$and": [{"type": {"$eq": "daily_summary"}}]}
     if AsOfDate:
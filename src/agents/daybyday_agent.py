@@ -8,7 +8,7 @@ from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
 
 from langchain.schema import HumanMessage
-from src.common import llm, SYSTEM_PREFIX, JSON_SCHEMA_INSTRUCTION, getChromaByPropertyCode
+from src.common import llm, SYSTEM_PREFIX, JSON_SCHEMA_INSTRUCTION, getVectorStore
 
 SYSTEM = SYSTEM_PREFIX + " Scope: day-by-day KPIs (occupancy, ADR, RevPAR, rooms sold, revenue). Return JSON."
 
@@ -29,7 +29,7 @@ def _parse_query(user_question: str, as_of: str) -> QuerySpec:
     return QuerySpec(date=date_str, text=user_question)
 
 def _retrieve_docs(property_code: str, as_of_date: str, spec: QuerySpec, widen: bool = False) -> Tuple[List[str], List[str]]:
-    chroma = getChromaByPropertyCode(property_code, collection_name="daily_summaries")
+    chroma = getVectorStore(property_code, collection_name="daily_summaries")
     query_terms = [spec.text]
 
     # Build filter
@@ -1,5 +1,5 @@
 # src/agents/daily_summary_agent.py
-from src.common import llm, SYSTEM_PREFIX, JSON_SCHEMA_INSTRUCTION, getChromaByPropertyCode
+from src.common import llm, SYSTEM_PREFIX, JSON_SCHEMA_INSTRUCTION, getVectorStore
 from src.db_utils import fetch_one
 import json
 from langchain.schema import HumanMessage
@@ -8,6 +8,37 @@ import re
  
 SYSTEM = SYSTEM_PREFIX + " Scope: daily snapshot and KPI explanations."
 
+# Question keywords -> Performance Monitor sections that can answer them; used to
+# narrow retrieval. Matched as whole words (an optional plural "s" allowed), so
+# "ari" does not fire on "variance" nor "rgi" on "margin".
+SECTION_KEYWORDS = {
+    "daily_performance_dashboard": ["dashboard", "property score", "mpi", "ari", "rgi", "left to sell"],
+    "adr_by_bookingdate": ["adr by booking", "booking date"],
+    "top10marketsegment_drilldown": ["market segment", "top segment"],
+    "dashboard_revglance": ["revglance", "at a glance", "nova forecast", "user forecast"],
+    "marketsegment_mix_chart": ["segment mix"],
+    "one_day_pickup_threshold": ["1 day pickup", "one day pickup", "1-day pickup"],
+    "candle_chart": ["candle", "opening rate", "closing rate", "high rate", "low rate"],
+    "comp_rate_variance_with_occ_self": ["competitor", "comp rate", "compset", "rate shop", "rateshop"],
+    "lowDemandDates": ["low demand", "need dates", "soft dates"],
+    "forecast_mix_chart": ["forecast mix", "spider", "forecast"],
+    "booking_pace_comparison_chart": ["booking pace", "pace"],
+    "seven_day_pickup_threshold": ["7 day pickup", "seven day pickup", "7-day pickup"],
+    "highDemandDates": ["high demand", "compression", "peak dates"],
+    "fourteen_day_pickup_threshold": ["14 day pickup", "fourteen day pickup", "14-day pickup"],
+    "top_10_event_strategy": ["event"],
+}
+
+_SECTION_PATTERNS = {
+    name: re.compile(r"\b(?:" + "|".join(re.escape(w) for w in words) + r")s?\b")
+    for name, words in SECTION_KEYWORDS.items()
+}
+
+def sections_for_question(user_question: str) -> list[str]:
+    """Return the Performance Monitor sections a question touches; empty means all."""
+    q = (user_question or "").lower()
+    return [name for name, pattern in _SECTION_PATTERNS.items() if pattern.search(q)]
+
 MONTHS = {
     "jan":1,"january":1, "feb":2,"february":2, "mar":3,"march":3, "apr":4,"april":4,
     "may":5, "jun":6,"june":6, "jul":7,"july":7, "aug":8,"august":8,
@@ -52,13 +83,17 @@ def parse_staydate(text: str) -> str | None:
 
 def agent_handle(user_question,propertyCode: str="", AsOfDate: str=""):
     print("Start agent script........")
-    chroma = getChromaByPropertyCode(propertyCode,collection_name="performance_monitor")
+    chroma = getVectorStore(propertyCode, collection_name="performance_monitor")
  
     flt = {"$and": [{"type": {"$eq": "performance_monitor"}}]}
     if AsOfDate:
-        flt["$and"].append({"AsOfDate": {"$eq": AsOfDate}})
+        flt["$and"].append({"as_of_date": {"$eq": AsOfDate}})
     if propertyCode:
-        flt["$and"].append({"propertyCode": {"$eq": propertyCode}})
+        flt["$and"].append({"property_code": {"$eq": propertyCode}})
+
+    sections = sections_for_question(user_question)
+    if sections:
+        flt["$and"].append({"section": {"$in": sections}})
 
     asked_date = parse_staydate(user_question)
     if asked_date:
@@ -71,6 +106,10 @@ def agent_handle(user_question,propertyCode: str="", AsOfDate: str=""):
         near = [(dt + timedelta(days=o)).strftime("%Y-%m-%d") for o in (-1, 1)]
         flt_near = {"$and": [c for c in flt["$and"] if "Dates" not in c] + [{"Dates": {"$in": near}}]}
         retrieved = chroma.similarity_search_with_score(user_question, k=10, filter=flt_near)
+    if not retrieved and sections:
+        # The keywords may have picked the wrong sections; search them all
+        flt_all = {"$and": [c for c in flt["$and"] if "section" not in c]}
+        retrieved = chroma.similarity_search_with_score(user_question, k=5, filter=flt_all)
 
 
     print(f"Retrieved {len(retrieved)} documents from Chroma.")
@@ -1,9 +1,11 @@
 # src/app.py
 from fastapi import FastAPI, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from typing import Dict, Any, Literal, Optional
 from pydantic import BaseModel
 import src.chroma_ingest as chroma_ingest
-from src.db_config import get_db_connection
+from src.db_config import async_db_available, get_async_engine, get_db_connection
+from src.data_layer import performance_monitor_report, performance_monitor_report_async, select_sections
 import sys
 import os
 
@@ -31,14 +33,15 @@ async def query_endpoint_get(
     as_of_date: str = Query(..., description="As Of Date (YYYY-MM-DD)"),
     q: str = Query(..., description="Query to execute"),
 ):
-    return handle_query(q, property_code, as_of_date)
+    # handle_query is synchronous (LLM + Chroma calls); keep it off the event loop
+    return await run_in_threadpool(handle_query, q, property_code, as_of_date)
 
 # ---------------------------
 # POST endpoint (JSON body)
 # ---------------------------
 @app.post("/query")
 async def query_endpoint_post(req: QueryRequest):
-    return handle_query(req.query, req.property_code, req.as_of_date)
+    return await run_in_threadpool(handle_query, req.query, req.property_code, req.as_of_date)
 
 @app.get("/ingest")
 async def ingest_endpoint(
@@ -48,38 +51,122 @@ async def ingest_endpoint(
     property_id: str = Query(...),
     client_id: str = Query(...),
     year: Optional[str] = Query(None),
+    sections: Optional[str] = Query(None, description="Comma-separated Performance Monitor sections (performance_monitor only)"),
+    incremental: bool = Query(False, description="Only re-ingest months changed since the last ingested as_of_date (annual_summary only)"),
+    chunking: Optional[Literal["leaf", "row", "rows", "section"]] = Query(None, description="Document granularity (performance_monitor only; default PM_CHUNKING)"),
+    upsert: bool = Query(False, description="Write only new or changed documents and delete vanished ones (annual_summary; performance_monitor always upserts)"),
 ):
     """
     Trigger ingestion of data into Chroma vector DB.
     Returns the number of documents ingested.
     """
-    logger.info(f"Received ingestion request: type={type}, property_code={property_code}, as_of_date={as_of_date}, property_id={property_id}, client_id={client_id}, year={year}")
+    logger.info(f"Received ingestion request: type={type}, property_code={property_code}, as_of_date={as_of_date}, property_id={property_id}, client_id={client_id}, year={year}, sections={sections}, incremental={incremental}, chunking={chunking}, upsert={upsert}")
+
+    ingest_kwargs: Dict[str, Any] = {}
+    if sections:
+        if type != "performance_monitor":
+            raise HTTPException(status_code=400, detail="The 'sections' parameter only applies to type 'performance_monitor'.")
+        section_list = [s.strip() for s in sections.split(",") if s.strip()]
+        try:
+            select_sections(section_list)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        ingest_kwargs["sections"] = section_list
+    if incremental:
+        if type != "annual_summary":
+            raise HTTPException(status_code=400, detail="The 'incremental' parameter only applies to type 'annual_summary'.")
+        ingest_kwargs["incremental"] = True
+    if chunking:
+        if type != "performance_monitor":
+            raise HTTPException(status_code=400, detail="The 'chunking' parameter only applies to type 'performance_monitor'.")
+        ingest_kwargs["chunking"] = chunking
+    if upsert:
+        if type not in ("annual_summary", "performance_monitor"):
+            raise HTTPException(status_code=400, detail="The 'upsert' parameter only applies to types 'annual_summary' and 'performance_monitor'.")
+        ingest_kwargs["upsert"] = True
+
     conn = None
+    report = None
     try:
-        conn = get_db_connection(PROPERTY_DATABASE=property_code, clientId=client_id)
-
         # Safe dynamic dispatch
         ingest_fn = getattr(chroma_ingest, f"ingest_{type}", None)
         if not callable(ingest_fn):
             raise HTTPException(status_code=400, detail=f"Ingestion function for type '{type}' not found.")
 
-        inserted_count = ingest_fn(
+        if type == "performance_monitor" and async_db_available():
+            # Sections are awaited on asyncpg, so other requests interleave with the fetch
+            engine = await get_async_engine(PROPERTY_DATABASE=property_code, clientId=client_id)
+            async with engine.connect() as async_conn:
+                report = await performance_monitor_report_async(
+                    PROPERTY_ID=property_id,
+                    PROPERTY_CODE=property_code,
+                    AS_OF_DATE=as_of_date,
+                    CLIENT_ID=client_id,
+                    conn=async_conn,
+                    sections=ingest_kwargs.get("sections"),
+                )
+        else:
+            conn = await run_in_threadpool(get_db_connection, PROPERTY_DATABASE=property_code, clientId=client_id)
+            if type == "performance_monitor":
+                report = await run_in_threadpool(
+                    performance_monitor_report,
+                    PROPERTY_ID=property_id,
+                    PROPERTY_CODE=property_code,
+                    AS_OF_DATE=as_of_date,
+                    CLIENT_ID=client_id,
+                    conn=conn,
+                    sections=ingest_kwargs.get("sections"),
+                )
+
+        if report is not None:
+            if report.payload is None:
+                # The whole fetch failed: nothing was ingested, stored documents are untouched
+                return {
+                    "status": "error",
+                    "type": type,
+                    "property_code": property_code,
+                    "as_of_date": as_of_date,
+                    "documents_ingested": 0,
+                    "errors": report.error_list,
+                }
+            ingest_kwargs["payload"] = (report.payload, report.error_list)
+            # Sections that ran but returned no rows still get their stale documents deleted
+            ingest_kwargs["statuses"] = report.statuses
+
+        # Embedding and the Chroma writes (and the sync fetches of the other types) block; run them on a worker thread
+        inserted_count = await run_in_threadpool(
+            ingest_fn,
             collection_name=type,
             PROPERTY_ID=property_id,
             PROPERTY_CODE=property_code,
             AS_OF_DATE=as_of_date,
             CLIENT_ID=client_id,
             conn=conn,
+            **ingest_kwargs,
         )
 
+        changes = None
+        if isinstance(inserted_count, dict):
+            # Upsert mode: per-outcome counts plus the collection size
+            changes = {k: v for k, v in inserted_count.items() if k != "total"}
+            inserted_count = inserted_count.get("total")
+
         # Prefer success + count, don’t misuse 500s for “no data”
-        return {
+        response = {
             "status": "success",
             "type": type,
             "property_code": property_code,
             "as_of_date": as_of_date,
             "documents_ingested": int(inserted_count or 0),
         }
+        if changes is not None:
+            response["changes"] = changes
+        if report is not None and report.incomplete_sections:
+            # Sections that failed or ran past PM_DEADLINE_SECONDS were not re-ingested (performance_monitor
+            # always upserts), so they keep whatever was previously ingested for this date
+            response["status"] = "partial"
+            response["incomplete_sections"] = {name: report.statuses.get(name) for name in report.incomplete_sections}
+        return response
 
     except HTTPException:
         # re-raise FastAPI HTTP errors
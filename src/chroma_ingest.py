@@ -7,8 +7,11 @@ import pandas as pd
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from langchain_openai import OpenAIEmbeddings
-from .common import getChromaByPropertyCode, delete_vectors, ingest_vectors
-from .document_list import daily_summaries_docs, reservation_docs, docs_performance_monitor, docs_annual_summary
+from .common import getVectorStore, refresh_numpy_mirror, cutoff_ts, delete_vectors, delete_superseded_snapshots, ingest_vectors, upsert_vectors, last_ingested_as_of, delete_month_vectors, delete_months_except
+from .embedding_pipeline import add_texts_pipelined
+from .vector_versions import building_version
+from .data_layer import performance_monitor_report
+from .document_list import iter_daily_summaries_docs, iter_reservation_docs, docs_performance_monitor, docs_annual_summary, annual_summary_months
 from utils.logger import get_custom_logger
 
 # -----------------------------------------------------------------------------
@@ -26,6 +29,10 @@ if not OPENAI_KEY:
  
 embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_KEY)
 
+# Performance Monitor snapshots (as_of_dates) kept per property, counting back from the ingested one;
+# older ones are deleted after each ingest, newer ones are left alone
+PM_KEEP_SNAPSHOTS = int(os.getenv("PM_KEEP_SNAPSHOTS", "1"))
+
 logger = get_custom_logger(name= "Chroma Ingest")
 
 # -----------------------------------------------------------------------------
@@ -34,18 +41,21 @@ logger = get_custom_logger(name= "Chroma Ingest")
 def ingest_daily_summaries(propertyCode, AsOfDate) -> None:
     try:
  
-        chroma = getChromaByPropertyCode(propertyCode,collection_name="daily_summaries")
+        chroma = getVectorStore(propertyCode, collection_name="daily_summaries", write=True)
  
-        # Daily summaries
-        docs, metadatas, ids = daily_summaries_docs(propertyCode, AsOfDate)
-        if docs:
+        # Daily summaries, one server-side cursor batch at a time
+        total = 0
+        for docs, metadatas, ids in iter_daily_summaries_docs(propertyCode, AsOfDate):
             texts = [doc.page_content for doc in docs]
             logger.info(f"Ingesting {len(texts)} docs")
-            chroma.add_texts(texts=texts, metadatas=metadatas, ids=ids)
-            logger.info("[Count] Docs in collection:", chroma._collection.count())
-            return chroma._collection.count()
+            add_texts_pipelined(chroma, texts, metadatas, ids)
+            total += len(texts)
+        if total:
+            refresh_numpy_mirror(chroma)
+            logger.info("[Count] Docs in collection: %s", chroma.count())
+            return chroma.count()
         else:
-            print("[Ingest] No daily summaries found to ingest.")
+            logger.info("[Ingest] No daily summaries found to ingest.")
             return 0
            
     except Exception as e:
@@ -56,18 +66,21 @@ def ingest_daily_summaries(propertyCode, AsOfDate) -> None:
 def ingest_reservation(propertyCode, AsOfDate) -> None:
     try:
  
-        chroma = getChromaByPropertyCode(propertyCode,collection_name="reservations")
+        chroma = getVectorStore(propertyCode, collection_name="reservations", write=True)
  
-        # Daily summaries
-        docs, metadatas, ids = reservation_docs(propertyCode, AsOfDate)
-        if docs:
+        # Reservations, one server-side cursor batch at a time
+        total = 0
+        for docs, metadatas, ids in iter_reservation_docs(propertyCode, AsOfDate):
             texts = [doc.page_content for doc in docs]
-            print(f"[Ingest] Ingesting {len(texts)} docs...")
-            chroma.add_texts(texts=texts, metadatas=metadatas, ids=ids)
-            print("[Count] Docs in collection:", chroma._collection.count())
-            return chroma._collection.count()
+            logger.info(f"[Ingest] Ingesting {len(texts)} docs...")
+            add_texts_pipelined(chroma, texts, metadatas, ids)
+            total += len(texts)
+        if total:
+            refresh_numpy_mirror(chroma)
+            logger.info("[Count] Docs in collection: %s", chroma.count())
+            return chroma.count()
         else:
-            print("[Ingest] No daily summaries found to ingest.")
+            logger.info("[Ingest] No reservations found to ingest.")
             return 0
            
     except Exception as e:
@@ -75,50 +88,129 @@ def ingest_reservation(propertyCode, AsOfDate) -> None:
         traceback.print_exc()
         return 0
 
-def ingest_performance_monitor(PROPERTY_ID="", PROPERTY_CODE="", AS_OF_DATE="", CLIENT_ID="",conn= None) -> None:
+def ingest_performance_monitor(collection_name: str = "performance_monitor", PROPERTY_ID="", PROPERTY_CODE="", AS_OF_DATE="", CLIENT_ID="",conn= None, sections=None, payload=None, statuses=None, upsert: bool = True, chunking=None) -> None:
     try:
  
-        chroma = getChromaByPropertyCode(PROPERTY_CODE,collection_name="performance_monitor")
- 
-        # Daily summaries
-        docs, metadatas, ids = docs_performance_monitor(PROPERTY_ID=PROPERTY_ID, PROPERTY_CODE=PROPERTY_CODE, AS_OF_DATE=AS_OF_DATE, CLIENT_ID=CLIENT_ID, conn=conn)
-        if docs:
-            texts = [doc.page_content for doc in docs]
-            print(f"[Ingest] Ingesting {len(texts)} docs...")
-            chroma.add_texts(texts=texts, metadatas=metadatas, ids=ids)
-            print("[Count] Docs in collection:", chroma._collection.count())
-            return chroma._collection.count()
+        chroma = getVectorStore(PROPERTY_CODE, collection_name=collection_name, write=True)
+
+        if payload is None:
+            report = performance_monitor_report(PROPERTY_ID, PROPERTY_CODE, AS_OF_DATE, CLIENT_ID, conn, sections)
+            payload, statuses = (report.payload, report.error_list), report.statuses
+
+        # Only the requested Performance Monitor sections (all when sections is None)
+        docs, metadatas, ids = docs_performance_monitor(PROPERTY_ID=PROPERTY_ID, PROPERTY_CODE=PROPERTY_CODE, AS_OF_DATE=AS_OF_DATE, CLIENT_ID=CLIENT_ID, conn=conn, sections=sections, payload=payload, chunking=chunking)
+
+        # Sections that ran, including those that now return no rows; a failed or
+        # timed-out section is left out, so it keeps what is stored instead of being wiped
+        if statuses is not None:
+            fetched = sorted(name for name in (payload[0] or {}) if statuses.get(name) in ("ok", "cached"))
         else:
-            print("[Ingest] No daily summaries found to ingest.")
+            fetched = sorted({meta["section"] for meta in metadatas})
+
+        if not docs and not (upsert and fetched):
+            logger.info("[Ingest] No Performance Monitor documents found to ingest.")
             return 0
+
+        if upsert:
+            # Diff against this snapshot's stored documents of those sections
+            scope = {"$and": [
+                {"property_code": {"$eq": PROPERTY_CODE}},
+                {"as_of_date": {"$eq": AS_OF_DATE}},
+                {"section": {"$in": fetched}},
+            ]}
+            counts = upsert_vectors(chroma, (docs, metadatas, ids), scope=scope)
+        else:
+            texts = [doc.page_content for doc in docs]
+            logger.info(f"[Ingest] Ingesting {len(texts)} docs...")
+            add_texts_pipelined(chroma, texts, metadatas, ids)
+            counts = None
+
+        delete_superseded_snapshots(PROPERTY_CODE, chroma, AS_OF_DATE, keep=PM_KEEP_SNAPSHOTS)
+        refresh_numpy_mirror(chroma)
+        logger.info("[Count] Docs in collection: %s", chroma.count())
+        if counts is not None:
+            return {**counts, "total": chroma.count()}
+        return chroma.count()
            
     except Exception as e:
         logger.error("Error during ingestion: %s", e)
         traceback.print_exc()
         return 0
 
+def _ingest_or_raise(chroma, docs_meta_ids: tuple) -> int:
+    # ingest_vectors logs and returns 0 on failure; raise instead so a half-built version is not published
+    docs = docs_meta_ids[0]
+    total = ingest_vectors(chroma, docs_meta_ids)
+    if docs and not total:
+        raise RuntimeError(f"Ingesting {len(docs)} documents into {chroma.name} failed")
+    return total
+
 def ingest_annual_summary(collection_name: str,
                           PROPERTY_ID: str = "", 
                           PROPERTY_CODE: str = "", 
                           AS_OF_DATE: str = "", 
                           CLIENT_ID:str ="",
-                          conn= None) -> None:
+                          conn= None,
+                          incremental: bool = False,
+                          upsert: bool = False) -> None:
     try:
         logger.info(f"Starting {collection_name} ingestion for {PROPERTY_CODE} as of {AS_OF_DATE}")
         property_db_dir = f"./{PROPERTY_CODE}"
-        chroma = getChromaByPropertyCode(PROPERTY_CODE, collection_name=collection_name, property_store_dir=property_db_dir)
-        delete_vectors(PROPERTY_CODE, AS_OF_DATE, chroma)
-        ingest_vectors(
-            chroma,
-            docs_annual_summary(
-                PROPERTY_ID=PROPERTY_ID,
-                PROPERTY_CODE=PROPERTY_CODE,
-                AS_OF_DATE=AS_OF_DATE,
-                CLIENT_ID=CLIENT_ID,
-                conn=conn
+
+        # Build into a new version seeded from the published one; queries keep reading the
+        # published version until the block exits and the pointer flips to the new one
+        with building_version(PROPERTY_CODE, collection_name, property_store_dir=property_db_dir, as_of_date=AS_OF_DATE) as chroma:
+
+            # Incremental: re-embed only the months whose numbers moved since the last ingested snapshot
+            previous = last_ingested_as_of(PROPERTY_CODE, chroma) if incremental else None
+            if previous and previous < AS_OF_DATE:
+                docs, metadatas, ids = docs_annual_summary(
+                    PROPERTY_ID=PROPERTY_ID,
+                    PROPERTY_CODE=PROPERTY_CODE,
+                    AS_OF_DATE=AS_OF_DATE,
+                    CLIENT_ID=CLIENT_ID,
+                    conn=conn,
+                    since_as_of_date=previous,
+                )
+                logger.info(f"{len(docs)} months changed since {previous}")
+                delete_month_vectors(PROPERTY_CODE, {(m["year"], m["month"]) for m in metadatas}, chroma)
+                # Months gone from the snapshot never show up as changed; drop them too
+                delete_months_except(PROPERTY_CODE, annual_summary_months(PROPERTY_CODE, AS_OF_DATE, conn), chroma)
+                _ingest_or_raise(chroma, (docs, metadatas, ids))
+                return int(chroma.count())
+
+            if upsert:
+                # Expire older snapshots as usual, but diff today's documents instead of replacing them
+                delete_vectors(PROPERTY_CODE, AS_OF_DATE, chroma, same_day=False)
+                asof_timestamp, _, _ = cutoff_ts(AS_OF_DATE)
+                counts = upsert_vectors(
+                    chroma,
+                    docs_annual_summary(
+                        PROPERTY_ID=PROPERTY_ID,
+                        PROPERTY_CODE=PROPERTY_CODE,
+                        AS_OF_DATE=AS_OF_DATE,
+                        CLIENT_ID=CLIENT_ID,
+                        conn=conn
+                    ),
+                    scope={"$and": [
+                        {"property_code": {"$eq": PROPERTY_CODE}},
+                        {"as_of_date_timestamp": {"$eq": asof_timestamp}},
+                    ]},
+                )
+                return {**counts, "total": int(chroma.count())}
+
+            delete_vectors(PROPERTY_CODE, AS_OF_DATE, chroma)
+            _ingest_or_raise(
+                chroma,
+                docs_annual_summary(
+                    PROPERTY_ID=PROPERTY_ID,
+                    PROPERTY_CODE=PROPERTY_CODE,
+                    AS_OF_DATE=AS_OF_DATE,
+                    CLIENT_ID=CLIENT_ID,
+                    conn=conn
+                )
             )
-        )
-        return int(chroma._collection.count())
+            return int(chroma.count())
     
 
     except Exception as e:
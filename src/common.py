@@ -1,12 +1,21 @@
 # src/agents/common.py
+import hashlib
+import json
 import os
+import threading
 import traceback
+from collections import OrderedDict
 from utils.logger import get_custom_logger
 from datetime import datetime, timedelta, timezone
-from typing import Tuple, Optional
+from typing import Dict, Tuple, Optional
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_chroma import Chroma
+from src.embedding_cache import CachedEmbeddings, model_name
+from src.embedding_pipeline import RateLimitedEmbeddings, add_texts_pipelined
+from src.vector_store import ChromaStore, NumpyStore, VectorStore, write_vec_file
+from src.vector_pack import VectorPack, load_pack, pack_path
+from src.vector_versions import current_collection
  
 load_dotenv()
  
@@ -44,30 +53,188 @@ OPENAI_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_KEY:
     raise ValueError("OPENAI_API_KEY is not set.")
 
-emb = OpenAIEmbeddings(api_key=OPENAI_KEY)
+# Document embeddings go through the content-hash cache, so re-ingests only embed changed text;
+# what does reach the API is rate limited and retried
+emb = CachedEmbeddings(RateLimitedEmbeddings(OpenAIEmbeddings(api_key=OPENAI_KEY)))
+
+# Opened Chroma stores kept per process, keyed by (persist_path, collection_name)
+CHROMA_CACHE_SIZE = int(os.getenv("CHROMA_CACHE_SIZE", "16"))
+
+_stores = OrderedDict()  # (persist_path, collection_name) -> Chroma, least recently used first
+_stores_lock = threading.Lock()
+_store_counters = {"opened": 0, "hits": 0, "evicted": 0}
+# NumPy stores, keyed by .vec path; same bound
+_numpy_stores = OrderedDict()
+
+# Vector backend: "chroma", "numpy" (one memory-mapped .vec file per collection, no Chroma at all)
+# or "auto" (Chroma, plus a NumPy mirror the agents read for collections of at most VECTOR_NUMPY_MAX_ROWS vectors)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "auto").lower()
+VECTOR_NUMPY_MAX_ROWS = int(os.getenv("VECTOR_NUMPY_MAX_ROWS", "5000"))
+# Directory of read-only <propertyCode>.rmcpack snapshots (python -m src.vector_pack export);
+# when set, agents read the collections a property's pack holds from it instead of any backend
+VECTOR_PACK_DIR = os.getenv("VECTOR_PACK_DIR", "")
+
+_packs: Dict[str, Tuple[tuple, Optional[VectorPack]]] = {}  # pack path -> (file signature, loaded pack)
+
+def property_store_path(propertyCode: str, property_store_dir: Optional[str] = None) -> str:
+    """Directory of a property's vector stores: `property_store_dir` (relative to the repo root) or ./<propertyCode>."""
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if property_store_dir:
+        if os.path.isabs(property_store_dir):
+            return property_store_dir
+        return os.path.normpath(os.path.join(repo_root, property_store_dir))
+    return os.path.join(repo_root, propertyCode)
 
 def getChromaByPropertyCode(
     propertyCode: str,
     collection_name: str,
     property_store_dir: Optional[str] = None,
 ) -> Chroma:
-    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    if property_store_dir:
-        if os.path.isabs(property_store_dir):
-            persist_path = property_store_dir
-        else:
-            persist_path = os.path.normpath(os.path.join(repo_root, property_store_dir))
-    else:
-        persist_path = os.path.join(repo_root, propertyCode)
+    """
+    Chroma store for a property's collection. Opened stores are reused from a
+    process-wide LRU of CHROMA_CACHE_SIZE entries. The coldest is only forgotten when
+    it overflows, never closed: another thread may still be querying it, and chromadb
+    shares one client system per directory, which is released with the last reference.
+    """
+    persist_path = property_store_path(propertyCode, property_store_dir)
+    key = (persist_path, collection_name)
+    with _stores_lock:
+        chroma = _stores.get(key)
+        if chroma is not None:
+            _stores.move_to_end(key)
+            _store_counters["hits"] += 1
+            return chroma
 
-    os.makedirs(persist_path, exist_ok=True)
+        os.makedirs(persist_path, exist_ok=True)
+        chroma = Chroma(
+            collection_name=collection_name,
+            persist_directory=persist_path,
+            embedding_function=emb,
+        )
+        _stores[key] = chroma
+        _store_counters["opened"] += 1
+        while len(_stores) > CHROMA_CACHE_SIZE:
+            _stores.popitem(last=False)
+            _store_counters["evicted"] += 1
+        return chroma
 
+def _numpy_store(persist_path: str, collection_name: str) -> NumpyStore:
+    path = os.path.join(persist_path, f"{collection_name}.vec")
+    with _stores_lock:
+        store = _numpy_stores.get(path)
+        if store is not None:
+            _numpy_stores.move_to_end(path)
+            return store
+        store = NumpyStore(path, embeddings=emb, name=collection_name, persist_path=persist_path)
+        _numpy_stores[path] = store
+        while len(_numpy_stores) > CHROMA_CACHE_SIZE:
+            _numpy_stores.popitem(last=False)
+        return store
 
-    return Chroma(
-        collection_name=collection_name,
-        persist_directory=persist_path,
-        embedding_function=emb,
-    )
+def _packed_store(propertyCode: str, collection_name: str) -> Optional[VectorStore]:
+    path = pack_path(VECTOR_PACK_DIR, propertyCode)
+    try:
+        st = os.stat(path)
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return None
+    with _stores_lock:
+        cached = _packs.get(path)
+        if cached is None or cached[0] != signature:
+            try:
+                pack = load_pack(path, embeddings=emb)
+                if pack.header.get("embedding_model") not in (None, model_name(emb)):
+                    logger.warning(f"{path} was embedded with {pack.header['embedding_model']}, queries use {model_name(emb)}")
+            except Exception as e:
+                logger.error(f"Could not load vector pack {path}: {e}")
+                pack = None
+            cached = _packs[path] = (signature, pack)
+    pack = cached[1]
+    return pack.stores.get(collection_name) if pack is not None else None
+
+def getVectorStore(
+    propertyCode: str,
+    collection_name: str,
+    property_store_dir: Optional[str] = None,
+    write: bool = False,
+) -> VectorStore:
+    """
+    The store agents query and ingest writes, per VECTOR_BACKEND. In "auto" mode
+    Chroma holds the data and ingest writes there; readers get the collection's
+    NumPy mirror when refresh_numpy_mirror has written one (at most
+    VECTOR_NUMPY_MAX_ROWS vectors), else Chroma. Readers get the property's
+    packed snapshot first when VECTOR_PACK_DIR holds one with this collection.
+    """
+    if VECTOR_PACK_DIR and not write:
+        packed = _packed_store(propertyCode, collection_name)
+        if packed is not None:
+            return packed
+    persist_path = property_store_path(propertyCode, property_store_dir)
+    # A versioned collection resolves to its published version (vector_versions)
+    collection_name = current_collection(persist_path, collection_name)
+    if VECTOR_BACKEND == "numpy" or (
+        VECTOR_BACKEND == "auto" and not write
+        and os.path.exists(os.path.join(persist_path, f"{collection_name}.vec"))
+    ):
+        return _numpy_store(persist_path, collection_name)
+    chroma = getChromaByPropertyCode(propertyCode, collection_name, property_store_dir)
+    return ChromaStore(chroma, persist_path=persist_path)
+
+def drop_vector_store(propertyCode: str, collection_name: str, property_store_dir: Optional[str] = None) -> None:
+    """Delete a collection, its NumPy mirror and any cached handle to them (superseded or failed versions)."""
+    persist_path = property_store_path(propertyCode, property_store_dir)
+    path = os.path.join(persist_path, f"{collection_name}.vec")
+    with _stores_lock:
+        _numpy_stores.pop(path, None)
+        chroma = _stores.pop((persist_path, collection_name), None)
+    if os.path.exists(path):
+        os.remove(path)
+    if VECTOR_BACKEND == "numpy":
+        return
+    if chroma is None:
+        # A one-off handle, so dropping a version never evicts a store still in the cache
+        chroma = Chroma(collection_name=collection_name, persist_directory=persist_path, embedding_function=emb)
+    chroma.delete_collection()
+
+def refresh_numpy_mirror(store: VectorStore) -> Optional[int]:
+    """
+    After an ingest in "auto" mode: rewrite the collection's .vec mirror when it
+    holds at most VECTOR_NUMPY_MAX_ROWS vectors, or drop the mirror when it has
+    outgrown it. Returns the vectors mirrored, None when there is no mirror.
+    """
+    if VECTOR_BACKEND != "auto" or not isinstance(store, ChromaStore) or not store.persist_path:
+        return None
+    path = os.path.join(store.persist_path, f"{store.name}.vec")
+    try:
+        if store.count() > VECTOR_NUMPY_MAX_ROWS:
+            if os.path.exists(path):
+                os.remove(path)
+                logger.info(f"{store.name} outgrew {VECTOR_NUMPY_MAX_ROWS} vectors, removed its NumPy mirror")
+            return None
+        res = store.get(include=["documents", "metadatas", "embeddings"])
+        ids = res.get("ids") or []
+        embeddings = res.get("embeddings")
+        write_vec_file(path, ids, embeddings if ids else [], res.get("documents") or [], res.get("metadatas") or [])
+        logger.info(f"Mirrored {len(ids)} vectors of {store.name} to {path}")
+        return len(ids)
+    except Exception as e:
+        # A stale mirror would serve old answers; fall back to Chroma instead
+        logger.error(f"Could not refresh NumPy mirror {path}: {e}")
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+
+def chroma_cache_stats() -> dict:
+    """Open/hit/eviction counters of the Chroma store cache and the stores it holds."""
+    with _stores_lock:
+        return {**_store_counters, "open": len(_stores), "numpy_open": len(_numpy_stores), "packs": len(_packs)}
+
+def clear_chroma_cache() -> None:
+    """Forget every cached store (tests, after deleting a property's directory)."""
+    with _stores_lock:
+        _stores.clear()
+        _numpy_stores.clear()
+        _packs.clear()
 # -----------------------------------------------------------------------------
 # Defining Cutoff Date for Deletion and Ingestion
 # -----------------------------------------------------------------------------
@@ -80,13 +247,12 @@ def cutoff_ts(as_of_date: str, days: int = 7) -> Tuple[int, datetime, int]:
 # -----------------------------------------------------------------------------
 # Deletion Function
 # -----------------------------------------------------------------------------
-def delete_vectors(propertyCode: str, AsOfDate: str, chroma: Chroma ) -> None:
+def delete_vectors(propertyCode: str, AsOfDate: str, chroma: VectorStore, same_day: bool = True) -> None:
     try:
-        collection = chroma._collection
         asof_timestamp, cutoff_date, cutoff_timestamp = cutoff_ts(AsOfDate, days=1)
-        logger.info(f"Documents in collection: {collection.count()}")
-        logger.info(f"Deleting documents older than {cutoff_date} from collection {collection.name}")
-        res = collection.get(
+        logger.info(f"Documents in collection: {chroma.count()}")
+        logger.info(f"Deleting documents older than {cutoff_date} from collection {chroma.name}")
+        res = chroma.get(
             where={
                 "$and": [
                     {"property_code": {"$eq": propertyCode}},
@@ -99,16 +265,19 @@ def delete_vectors(propertyCode: str, AsOfDate: str, chroma: Chroma ) -> None:
         
         if victims:
             logger.info(f"Found {len(victims)} documents to delete")
-            collection.delete(ids=victims)
-            logger.info(f"Deleted documents older than {cutoff_date} from collection {collection.name}")
-            logger.info(f"Documents in collection after deletion: {collection.count()}")
+            chroma.delete(ids=victims)
+            logger.info(f"Deleted documents older than {cutoff_date} from collection {chroma.name}")
+            logger.info(f"Documents in collection after deletion: {chroma.count()}")
         else:
             logger.info("No documents to delete")
 
         
 
-        logger.info(f"Deleting Same day documents for {AsOfDate} from collection {collection.name}")
-        res_same_day = collection.get(
+        if not same_day:
+            return
+
+        logger.info(f"Deleting Same day documents for {AsOfDate} from collection {chroma.name}")
+        res_same_day = chroma.get(
             where={
                 "$and": [
                     {"property_code": {"$eq": propertyCode}},
@@ -121,7 +290,7 @@ def delete_vectors(propertyCode: str, AsOfDate: str, chroma: Chroma ) -> None:
         
         if same_day_victims:
             logger.info(f"Found {len(same_day_victims)} same day documents to delete.")
-            collection.delete(ids=same_day_victims)
+            chroma.delete(ids=same_day_victims)
         else:
             logger.info("No same day documents to delete")
 
@@ -129,19 +298,88 @@ def delete_vectors(propertyCode: str, AsOfDate: str, chroma: Chroma ) -> None:
         logger.error("Error during deletion: %s", e)
         traceback.print_exc()
 
+def last_ingested_as_of(propertyCode: str, chroma: VectorStore) -> Optional[str]:
+    """Latest as_of_date already stored for the property, or None for an empty collection."""
+    res = chroma.get(
+        where={"property_code": {"$eq": propertyCode}},
+        include=["metadatas"],
+    )
+    dates = [m.get("as_of_date") for m in (res.get("metadatas") or []) if m and m.get("as_of_date")]
+    return max(dates) if dates else None
+
+def delete_month_vectors(propertyCode: str, months, chroma: VectorStore) -> int:
+    """Delete the property's documents for the given (year, month) pairs."""
+    deleted = 0
+    for year, month in months:
+        res = chroma.get(
+            where={
+                "$and": [
+                    {"property_code": {"$eq": propertyCode}},
+                    {"year": {"$eq": year}},
+                    {"month": {"$eq": month}},
+                ]
+            },
+            include=[],
+        )
+        victims = res.get("ids", []) or []
+        if victims:
+            chroma.delete(ids=victims)
+            deleted += len(victims)
+    logger.info(f"Deleted {deleted} documents for {len(months)} changed months from collection {chroma.name}")
+    return deleted
+
+def delete_months_except(propertyCode: str, months, chroma: VectorStore) -> int:
+    """
+    Delete the property's documents for every (year, month) not in `months`, i.e.
+    months that disappeared from the source. An empty `months` deletes nothing.
+    """
+    keep = set(months)
+    if not keep:
+        logger.warning(f"No months given for {propertyCode}, not pruning collection {chroma.name}")
+        return 0
+    res = chroma.get(where={"property_code": {"$eq": propertyCode}}, include=["metadatas"])
+    victims = [
+        doc_id for doc_id, meta in zip(res.get("ids") or [], res.get("metadatas") or [])
+        if ((meta or {}).get("year"), (meta or {}).get("month")) not in keep
+    ]
+    if victims:
+        chroma.delete(ids=victims)
+        logger.info(f"Deleted {len(victims)} documents of months no longer in the source from collection {chroma.name}")
+    return len(victims)
+
+def delete_superseded_snapshots(propertyCode: str, chroma: VectorStore, as_of_date: str, keep: int = 1) -> int:
+    """
+    Delete the property's documents of as_of_dates older than the `keep` most recent
+    snapshots up to and including `as_of_date`. `as_of_date` itself and newer
+    snapshots are never deleted. Returns the number of documents deleted.
+    """
+    res = chroma.get(where={"property_code": {"$eq": propertyCode}}, include=["metadatas"])
+    by_date = {}
+    for doc_id, meta in zip(res.get("ids") or [], res.get("metadatas") or []):
+        by_date.setdefault((meta or {}).get("as_of_date") or "", []).append(doc_id)
+    older = sorted((as_of for as_of in by_date if as_of < as_of_date), reverse=True)
+    superseded = older[max(keep, 1) - 1:]
+    victims = [doc_id for as_of in superseded for doc_id in by_date[as_of]]
+    if victims:
+        # Legacy copies can be many; stay under Chroma's max batch size
+        for start in range(0, len(victims), 5000):
+            chroma.delete(ids=victims[start:start + 5000])
+        logger.info(f"Deleted {len(victims)} documents of {len(superseded)} snapshots older than {as_of_date} from collection {chroma.name}")
+    return len(victims)
+
 # -----------------------------------------------------------------------------
 # Ingestion Function
 # -----------------------------------------------------------------------------
-def ingest_vectors(chroma: Chroma,
+def ingest_vectors(chroma: VectorStore,
                    docs_meta_ids: tuple) -> int:
     try:
         docs, metadatas, ids = docs_meta_ids
         if docs:
             texts = [doc.page_content for doc in docs]
-            logger.info(f"Ingesting {len(texts)} docs for {chroma._collection.name} ")
-            chroma.add_texts(texts=texts, metadatas=metadatas, ids=ids)
-            logger.info(f"Docs in collection after ingestion: {chroma._collection.count()}")
-            return chroma._collection.count()
+            logger.info(f"Ingesting {len(texts)} docs for {chroma.name} ")
+            add_texts_pipelined(chroma, texts, metadatas, ids)
+            logger.info(f"Docs in collection after ingestion: {chroma.count()}")
+            return chroma.count()
         else:
             logger.info("No docs found to ingest")
             return 0
@@ -149,3 +387,64 @@ def ingest_vectors(chroma: Chroma,
         logger.error("Error during ingestion: %s", e)
         traceback.print_exc()
         return 0
+
+# -----------------------------------------------------------------------------
+# Upsert Function
+# -----------------------------------------------------------------------------
+def content_hash(text: str, metadata: Optional[dict]) -> str:
+    """Checksum of a document's text and metadata (minus the checksum itself)."""
+    meta = {k: v for k, v in (metadata or {}).items() if k != "content_hash"}
+    digest = hashlib.sha256(text.encode("utf-8"))
+    digest.update(json.dumps(meta, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+def upsert_vectors(chroma: VectorStore, docs_meta_ids: tuple, scope: Optional[dict] = None) -> Dict[str, int]:
+    """
+    Write only what changed. Documents are matched by ID and compared by content
+    hash (stored in their `content_hash` metadata): new IDs are added, changed ones
+    re-embedded and overwritten, identical ones left alone. With a `scope` (a Chroma
+    `where` filter), stored documents in that scope whose ID is no longer produced
+    are deleted. Returns counts of added, updated, deleted and unchanged documents.
+    """
+    docs, metadatas, ids = docs_meta_ids
+
+    incoming = {}
+    for doc, meta, doc_id in zip(docs, metadatas, ids):
+        meta = dict(meta or {})
+        meta["content_hash"] = content_hash(doc.page_content, meta)
+        incoming[doc_id] = (doc.page_content, meta)
+
+    if scope is not None:
+        stored = chroma.get(where=scope, include=["metadatas"])
+    else:
+        stored = chroma.get(ids=list(incoming), include=["metadatas"]) if incoming else {}
+    stored_hashes = {
+        doc_id: (meta or {}).get("content_hash")
+        for doc_id, meta in zip(stored.get("ids") or [], stored.get("metadatas") or [])
+    }
+
+    changed = [doc_id for doc_id, (_, meta) in incoming.items() if stored_hashes.get(doc_id) != meta["content_hash"]]
+    counts = {
+        "added": sum(1 for doc_id in changed if doc_id not in stored_hashes),
+        "updated": sum(1 for doc_id in changed if doc_id in stored_hashes),
+        "deleted": 0,
+        "unchanged": len(incoming) - len(changed),
+    }
+    if changed:
+        add_texts_pipelined(
+            chroma,
+            [incoming[doc_id][0] for doc_id in changed],
+            [incoming[doc_id][1] for doc_id in changed],
+            changed,
+        )
+    if scope is not None:
+        gone = [doc_id for doc_id in stored_hashes if doc_id not in incoming]
+        if gone:
+            chroma.delete(ids=gone)
+        counts["deleted"] = len(gone)
+
+    logger.info(
+        f"Upserted into {chroma.name}: {counts['added']} added, {counts['updated']} updated, "
+        f"{counts['deleted']} deleted, {counts['unchanged']} unchanged"
+    )
+    return counts
@@ -1,7 +1,11 @@
 from sqlalchemy import create_engine, text
+import asyncio
 import os
+import threading
+import time
+from collections import OrderedDict
 import mysql.connector
-from urllib.parse import urlparse
+from urllib.parse import parse_qsl, urlparse
 import json
 from dotenv import load_dotenv
 
@@ -9,8 +13,15 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
-def get_super_db_connection(PROPERTY_DATABASE, clientId):
+# Resolved tenant descriptors are reused for TENANT_CACHE_TTL seconds; unknown tenants
+# are remembered for TENANT_CACHE_NEGATIVE_TTL. A hit past TENANT_CACHE_REFRESH_AHEAD of
+# the TTL refreshes the entry in the background so callers never wait on the master DB.
+TENANT_CACHE_TTL = int(os.getenv("TENANT_CACHE_TTL", "600"))
+TENANT_CACHE_NEGATIVE_TTL = int(os.getenv("TENANT_CACHE_NEGATIVE_TTL", "60"))
+TENANT_CACHE_REFRESH_AHEAD = float(os.getenv("TENANT_CACHE_REFRESH_AHEAD", "0.8"))
 
+def _query_super_db(PROPERTY_DATABASE, clientId):
+    """Look the tenant descriptor up in the master DB. None means unknown; errors raise."""
     connection = mysql.connector.connect(
         host=os.environ['MASTER_DB_HOST'],
         user=os.environ['MASTER_DB_USERNAME'],
@@ -27,9 +38,6 @@ def get_super_db_connection(PROPERTY_DATABASE, clientId):
                 cursor.execute(query)
                 result = cursor.fetchall()
                 return result[0] if result else None
-            except Exception as e:
-                print("Error:", e)
-                return None
             finally:
                 cursor.close()  
                 connection.close()  
@@ -44,20 +52,143 @@ def get_super_db_connection(PROPERTY_DATABASE, clientId):
                 cursor.execute(query)
                 result = cursor.fetchall()
                 return result[0] if result else None
-            except Exception as e:
-                print("Error:", e)
-                return None
             finally:
                 cursor.close()  
                 connection.close() 
     else:
-        print("Err:: Client Database Not connected!!!")
+        connection.close()
+        raise ConnectionError("Client Database Not connected")
 
-def get_db_connection(PROPERTY_DATABASE='', clientId=''):
+_descriptors = {}  # (property_code, clientId) -> (descriptor or None, fetched at (monotonic))
+_descriptors_lock = threading.Lock()
+_refreshing = set()
+
+def _tenant_key(PROPERTY_DATABASE, clientId):
+    return (PROPERTY_DATABASE or "", str(clientId or ""))
+
+def _load_descriptor(key, PROPERTY_DATABASE, clientId):
+    descriptor = _query_super_db(PROPERTY_DATABASE, clientId)
+    with _descriptors_lock:
+        _descriptors[key] = (descriptor, time.monotonic())
+    return descriptor
+
+def _refresh_descriptor(key, PROPERTY_DATABASE, clientId):
+    try:
+        _load_descriptor(key, PROPERTY_DATABASE, clientId)
+    except Exception as e:
+        # Keep serving the cached descriptor; the next hit past the TTL retries inline
+        print("Error refreshing tenant descriptor:", e)
+    finally:
+        with _descriptors_lock:
+            _refreshing.discard(key)
+
+def get_super_db_connection(PROPERTY_DATABASE, clientId):
+    """Tenant connection descriptor from the master DB, served from a process-wide TTL cache."""
+    key = _tenant_key(PROPERTY_DATABASE, clientId)
+    now = time.monotonic()
+    with _descriptors_lock:
+        entry = _descriptors.get(key)
+    if entry is not None:
+        descriptor, fetched_at = entry
+        ttl = TENANT_CACHE_TTL if descriptor is not None else TENANT_CACHE_NEGATIVE_TTL
+        age = now - fetched_at
+        if age < ttl:
+            if descriptor is not None and age > ttl * TENANT_CACHE_REFRESH_AHEAD:
+                with _descriptors_lock:
+                    start = key not in _refreshing
+                    _refreshing.add(key)
+                if start:
+                    threading.Thread(
+                        target=_refresh_descriptor, args=(key, PROPERTY_DATABASE, clientId),
+                        name="tenant-refresh", daemon=True,
+                    ).start()
+            return descriptor
+
+    try:
+        return _load_descriptor(key, PROPERTY_DATABASE, clientId)
+    except Exception as e:
+        print("Error:", e)
+        # Stale beats nothing while the master DB is unreachable
+        return entry[0] if entry is not None else None
+
+def forget_tenant(PROPERTY_DATABASE=None, clientId=None):
+    """Drop cached descriptors: one tenant, or all of them when called without arguments."""
+    with _descriptors_lock:
+        if PROPERTY_DATABASE is None and clientId is None:
+            _descriptors.clear()
+        else:
+            _descriptors.pop(_tenant_key(PROPERTY_DATABASE, clientId), None)
+
+def prime_tenants(property_codes, clientId=''):
+    """
+    Resolve many property databases with one master DB query and seed the descriptor
+    cache with them, so the get_db_url / get_engine calls that follow don't query the
+    master DB once per property. Returns the property codes that have no configuration.
+    Codes already cached (and fresh) are not looked up again.
+    """
+    now = time.monotonic()
+    wanted = []
+    with _descriptors_lock:
+        for code in dict.fromkeys(property_codes):
+            entry = _descriptors.get(_tenant_key(code, clientId))
+            if entry is None or entry[0] is None or now - entry[1] >= TENANT_CACHE_TTL:
+                wanted.append(code)
+    if not wanted:
+        return []
+
+    connection = mysql.connector.connect(
+        host=os.environ['MASTER_DB_HOST'],
+        user=os.environ['MASTER_DB_USERNAME'],
+        password=os.environ['MASTER_DB_PASSWORD'],
+        database=os.environ['MASTER_DB_NAME'],
+        port=int(os.environ['MASTER_DB_PORT'])
+    )
+    cursor = connection.cursor(dictionary=True)
+    try:
+        placeholders = ", ".join(["%s"] * len(wanted))
+        query = f"""SELECT p.propertycode, d.revenuconfigurationbyproperty_db
+            FROM pro_property p
+            JOIN mst_client_db_details d ON d.clientid = p.clientid
+            WHERE p.propertycode IN ({placeholders})"""
+        args = list(wanted)
+        if clientId not in ("", None):
+            query += " AND p.clientid = %s"
+            args.append(clientId)
+        cursor.execute(query, args)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        connection.close()
+
+    found = {}
+    for row in rows:
+        # pro_property may list a code more than once; the first row wins, like LIMIT 1 above.
+        # Keyed case-insensitively, as MySQL matched them.
+        found.setdefault(str(row['propertycode']).lower(), {'revenuconfigurationbyproperty_db': row['revenuconfigurationbyproperty_db']})
+    fetched_at = time.monotonic()
+    with _descriptors_lock:
+        for code in wanted:
+            _descriptors[_tenant_key(code, clientId)] = (found.get(str(code).lower()), fetched_at)
+    return [code for code in wanted if str(code).lower() not in found]
+
+# Pool settings for the process-wide engines in get_engine() / get_db_connection()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Engines unused for this long are disposed, closing their pooled connections
+DB_ENGINE_IDLE_SECONDS = int(os.getenv("DB_ENGINE_IDLE_SECONDS", "900"))
+# Seconds to wait for a tenant Postgres connection (libpq connect_timeout; 0 waits forever)
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+# Upper bound on tenant engines (and so on pooled sockets: DB_MAX_ENGINES * (pool_size + max_overflow))
+DB_MAX_ENGINES = int(os.getenv("DB_MAX_ENGINES", "32"))
+
+def get_db_url(PROPERTY_DATABASE='', clientId=''):
     conn_str = get_super_db_connection(PROPERTY_DATABASE, clientId)
     if not conn_str:
         raise ValueError(f"No configuration found for PROPERTY_DATABASE='{PROPERTY_DATABASE}' and clientId='{clientId}'")
+    return _dsn_from_descriptor(PROPERTY_DATABASE, conn_str)
 
+def _dsn_from_descriptor(PROPERTY_DATABASE, conn_str):
     if PROPERTY_DATABASE == "" or PROPERTY_DATABASE is None:
         ConfigurationDb = conn_str['configuration_db']
         ConfigurationDbComponents = dict(item.strip().split('=') for item in ConfigurationDb.split(';'))  
@@ -90,11 +221,205 @@ def get_db_connection(PROPERTY_DATABASE='', clientId=''):
 
         conn_str = (
             f"postgresql+psycopg2://{username}:{password}@{host}:{port}/{db_name}"
-            "?connect_timeout=0"
+            f"?connect_timeout={DB_CONNECT_TIMEOUT}"
         )
     
     # print("Final Connection String:", conn_str)
+    return conn_str
+
+def get_db_connection(PROPERTY_DATABASE='', clientId=''):
+    """Pooled connection to the tenant database; close() returns it to the pool."""
+    return get_engine(PROPERTY_DATABASE, clientId).connect()
+
+# -----------------------------------------------------------------------------
+# Engine registry
+# -----------------------------------------------------------------------------
+_engines = OrderedDict()  # DSN -> [engine, last used (monotonic)], least recently used first
+_engines_lock = threading.Lock()
+_engine_counters = {"hits": 0, "created": 0, "evicted": 0, "idle_disposed": 0}
+
+def _checked_out(engine):
+    try:
+        return engine.pool.checkedout()
+    except Exception:
+        return 0
+
+def _dispose_idle_engines(now):
+    """Dispose engines idle for longer than DB_ENGINE_IDLE_SECONDS. Caller holds _engines_lock."""
+    for dsn, (engine, last_used) in list(_engines.items()):
+        if now - last_used > DB_ENGINE_IDLE_SECONDS and not _checked_out(engine):
+            del _engines[dsn]
+            engine.dispose()
+            _engine_counters["idle_disposed"] += 1
+
+def _evict_cold_engines():
+    """
+    Keep at most DB_MAX_ENGINES engines. The least recently used engine without
+    checked-out connections goes first; if every engine is busy the oldest goes anyway
+    (its checked-out connections stay valid until returned). Caller holds _engines_lock.
+    """
+    while len(_engines) > DB_MAX_ENGINES:
+        victim = next((dsn for dsn, (engine, _) in _engines.items() if not _checked_out(engine)), None)
+        if victim is None:
+            victim = next(iter(_engines))
+        engine, _ = _engines.pop(victim)
+        engine.dispose()
+        _engine_counters["evicted"] += 1
+
+def get_engine(PROPERTY_DATABASE='', clientId=''):
+    """
+    Process-wide pooled engine for a tenant database, keyed by its resolved DSN.
+    Connections are pre-pinged on checkout and recycled after DB_POOL_RECYCLE seconds;
+    at most DB_MAX_ENGINES engines are kept, cold ones are disposed first.
+    """
+    # Descriptor lookups are cached, so resolving the DSN is cheap after the first call
+    dsn = get_db_url(PROPERTY_DATABASE, clientId)
+    now = time.monotonic()
+    with _engines_lock:
+        _dispose_idle_engines(now)
+        entry = _engines.get(dsn)
+        if entry is not None:
+            entry[1] = now
+            _engines.move_to_end(dsn)
+            _engine_counters["hits"] += 1
+            return entry[0]
+
+        engine = create_engine(
+            dsn,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+        )
+        _engines[dsn] = [engine, now]
+        _engine_counters["created"] += 1
+        _evict_cold_engines()
+        return engine
+
+def engine_stats():
+    """Registry counters plus checked-out / idle connection counts per database."""
+    with _engines_lock:
+        pools = {}
+        for dsn, (engine, _) in _engines.items():
+            pool = engine.pool
+            pools[engine.url.render_as_string(hide_password=True)] = {
+                "checked_out": _checked_out(engine),
+                "idle": pool.checkedin() if hasattr(pool, "checkedin") else 0,
+                "overflow": pool.overflow() if hasattr(pool, "overflow") else 0,
+            }
+        return {
+            **_engine_counters,
+            "engines": len(_engines),
+            "async_engines": len(_async_engines),
+            "checked_out": sum(p["checked_out"] for p in pools.values()),
+            "idle": sum(p["idle"] for p in pools.values()),
+            "pools": pools,
+        }
+
+def dispose_engines():
+    """Dispose every registered engine (shutdown, tests, credential rotation)."""
+    with _engines_lock:
+        engines = [engine for engine, _ in _engines.values()]
+        _engines.clear()
+    for engine in engines:
+        engine.dispose()
+
+# -----------------------------------------------------------------------------
+# Async engine registry
+# -----------------------------------------------------------------------------
+try:
+    import asyncpg  # noqa: F401  (driver behind postgresql+asyncpg)
+    from sqlalchemy.ext.asyncio import create_async_engine
+except ImportError:  # optional: callers fall back to the sync engines in a worker thread
+    create_async_engine = None
+
+_async_engines = OrderedDict()  # (event loop, DSN) -> [async engine, last used (monotonic)]
+
+def async_db_available():
+    """True when SQLAlchemy asyncio and asyncpg are installed."""
+    return create_async_engine is not None
+
+def _async_dsn(dsn):
+    """
+    Sync tenant DSN -> (asyncpg DSN, connect_args). asyncpg.connect() does not take
+    libpq URL options, so the ones we know are translated into its keyword arguments.
+    """
+    if not dsn.startswith("postgresql+psycopg2://"):
+        raise ValueError("Only PostgreSQL tenant databases have an async driver")
+    base, _, query = dsn.replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1).partition("?")
+    connect_args = {}
+    for name, value in parse_qsl(query):
+        if name == "connect_timeout":
+            # libpq's 0 waits forever; asyncpg has no such value, so its default (60s) applies
+            if float(value) > 0:
+                connect_args["timeout"] = float(value)
+        elif name == "sslmode":
+            connect_args["ssl"] = value
+        elif name == "application_name":
+            connect_args.setdefault("server_settings", {})["application_name"] = value
+        else:
+            print(f"Ignoring DSN option '{name}' on the asyncpg connection")
+    return base, connect_args
+
+async def get_async_engine(PROPERTY_DATABASE='', clientId=''):
+    """
+    Async counterpart of get_engine(): a pooled asyncpg-backed AsyncEngine for a tenant
+    database. asyncpg connections belong to the event loop that opened them, so engines
+    are keyed by (loop, DSN); the same pool settings and DB_MAX_ENGINES bound apply.
+    """
+    if create_async_engine is None:
+        raise RuntimeError("Async database access needs sqlalchemy[asyncio] and asyncpg")
+    # The descriptor lookup may hit the master DB (blocking MySQL), keep it off the loop
+    sync_dsn = await asyncio.to_thread(get_db_url, PROPERTY_DATABASE, clientId)
+    dsn, connect_args = _async_dsn(sync_dsn)
+    key = (asyncio.get_running_loop(), sync_dsn)
+    now = time.monotonic()
+    stale = []
+    with _engines_lock:
+        entry = _async_engines.get(key)
+        if entry is not None:
+            entry[1] = now
+            _async_engines.move_to_end(key)
+            _engine_counters["hits"] += 1
+            return entry[0]
+
+        engine = create_async_engine(
+            dsn,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+            connect_args=connect_args,
+        )
+        _async_engines[key] = [engine, now]
+        _engine_counters["created"] += 1
+        for other in [k for k, (_, last_used) in _async_engines.items() if now - last_used > DB_ENGINE_IDLE_SECONDS]:
+            stale.append((other[0], _async_engines.pop(other)[0]))
+        while len(_async_engines) > DB_MAX_ENGINES:
+            other, (old, _) = _async_engines.popitem(last=False)
+            stale.append((other[0], old))
+    # AsyncEngine.dispose() is a coroutine, so it runs outside the registry lock. Pools of
+    # another loop can't be closed from here; they are only dereferenced.
+    for loop, old in stale:
+        if loop is key[0]:
+            await old.dispose()
+        else:
+            old.sync_engine.dispose(close=False)
+        _engine_counters["evicted"] += 1
+    return engine
+
+async def get_async_db_connection(PROPERTY_DATABASE='', clientId=''):
+    """
+    Pooled AsyncConnection to the tenant database. Use it as `async with`, or await
+    its close() to return it to the pool.
+    """
+    engine = await get_async_engine(PROPERTY_DATABASE, clientId)
+    return engine.connect()
 
-    engine = create_engine(conn_str)
-    conn = engine.connect()
-    return conn
\ No newline at end of file
+async def dispose_async_engines():
+    """Dispose the async engines opened on the running event loop (shutdown hook)."""
+    loop = asyncio.get_running_loop()
+    with _engines_lock:
+        engines = [_async_engines.pop(key)[0] for key in list(_async_engines) if key[0] is loop]
+    for engine in engines:
+        await engine.dispose()
@@ -1,54 +1,186 @@
 import os
+import asyncio
+import re
+import threading
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
 from dotenv import load_dotenv
 import traceback
+from utils.logger import get_custom_logger
+
+try:
+    import asyncpg
+except ImportError:  # optional: fetch_*_async falls back to the threaded pool
+    asyncpg = None
 
 load_dotenv()
 
+logger = get_custom_logger(name="db_utils")
+
+# Pool bounds and per-statement timeout for fetch_one / fetch_all (and their async variants)
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+PG_STATEMENT_TIMEOUT_MS = int(os.getenv("PG_STATEMENT_TIMEOUT_MS", "30000"))
+# How long a caller waits for a free pooled connection before giving up
+PG_POOL_WAIT_SECONDS = float(os.getenv("PG_POOL_WAIT_SECONDS", "10"))
+
+
+def _connect_kwargs():
+    return dict(
+        host=os.getenv("PG_HOST"),
+        port=os.getenv("PG_PORT"),
+        user=os.getenv("PG_USER"),
+        password=os.getenv("PG_PASS"),
+        dbname=os.getenv("PG_DB"),
+    )
+
 
 def get_pg_conn():
     return psycopg2.connect(
-    host=os.getenv("PG_HOST"),
-    port=os.getenv("PG_PORT"),
-    user=os.getenv("PG_USER"),
-    password=os.getenv("PG_PASS"),
-    dbname=os.getenv("PG_DB"),
-)
+        **_connect_kwargs(),
+        options=f"-c statement_timeout={PG_STATEMENT_TIMEOUT_MS}",
+    )
 
-def fetch_one(query, params=None):
-    """Fetch a single record as dict."""
-    conn = get_pg_conn()
+# -----------------------------------------------------------------------------
+# Threaded pool
+# -----------------------------------------------------------------------------
+_pool = None
+_pool_slots = threading.BoundedSemaphore(PG_POOL_MAX)
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadedConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = ThreadedConnectionPool(
+                PG_POOL_MIN,
+                PG_POOL_MAX,
+                **_connect_kwargs(),
+                options=f"-c statement_timeout={PG_STATEMENT_TIMEOUT_MS}",
+            )
+        return _pool
+
+
+def _run(query, params, fetch):
+    # ThreadedConnectionPool raises instead of waiting when exhausted; queue on a semaphore
+    if not _pool_slots.acquire(timeout=PG_POOL_WAIT_SECONDS):
+        raise TimeoutError(f"No pooled Postgres connection free after {PG_POOL_WAIT_SECONDS}s")
+    pool = conn = None
     try:
+        pool = _get_pool()
+        conn = pool.getconn()
+        conn.autocommit = True
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            print(f"Running SQL: {query}")
-            if params:
-                print(f"With params: {params}")
+            logger.debug(f"Running SQL: {query} with params: {params}")
             cur.execute(query, params or ())
-            res = cur.fetchone()
-            return res
+            return fetch(cur)
+    finally:
+        if conn is not None:
+            # A dropped connection is discarded instead of going back to the pool
+            pool.putconn(conn, close=bool(conn.closed))
+        _pool_slots.release()
+
+
+def fetch_one(query, params=None):
+    """Fetch a single record as dict."""
+    try:
+        return _run(query, params, lambda cur: cur.fetchone())
     except Exception as e:
-        print("❌ [DB ERROR] fetch_one failed:", e)
+        logger.error(f"fetch_one failed: {e}")
         traceback.print_exc()
         raise
-    finally:
-        conn.close()
+
 
 def fetch_all(query, params=None):
     """Fetch all records as list of dicts."""
-    conn = get_pg_conn()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            print(f"Running SQL: {query}")
-            if params:
-                print(f"With params: {params}")
-            cur.execute(query, params or ())
-            res = cur.fetchall()
-            print(f"Rows returned: {len(res)}")
-            return res
+        res = _run(query, params, lambda cur: cur.fetchall())
+        logger.debug(f"Rows returned: {len(res)}")
+        return res
     except Exception as e:
-        print("❌ [DB ERROR] fetch_all failed:", e)
+        logger.error(f"fetch_all failed: {e}")
         traceback.print_exc()
         raise
-    finally:
-        conn.close()
\ No newline at end of file
+
+
+def close_pool():
+    """Close every pooled connection (shutdown hook)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+        _pool = None
+
+# -----------------------------------------------------------------------------
+# asyncio variant
+# -----------------------------------------------------------------------------
+_async_pools = {}  # event loop -> asyncpg pool
+_PARAM_RE = re.compile(r"%\((\w+)\)s|%s|%%")
+
+
+def _to_asyncpg(query, params):
+    """Rewrite psycopg2 `%s` / `%(name)s` placeholders to asyncpg's `$n`."""
+    args, names = [], {}
+    positional = iter(params or ()) if not isinstance(params, dict) else None
+
+    def placeholder(m):
+        if m.group(0) == "%%":
+            return "%"
+        if m.group(1) is not None:
+            name = m.group(1)
+            if name not in names:
+                args.append(params[name])
+                names[name] = len(args)
+            return f"${names[name]}"
+        args.append(next(positional))
+        return f"${len(args)}"
+
+    return _PARAM_RE.sub(placeholder, query), args
+
+
+async def _get_async_pool():
+    loop = asyncio.get_running_loop()
+    pool = _async_pools.get(loop)
+    if pool is None:
+        kwargs = _connect_kwargs()
+        pool = await asyncpg.create_pool(
+            host=kwargs["host"],
+            port=int(kwargs["port"]) if kwargs["port"] else None,
+            user=kwargs["user"],
+            password=kwargs["password"],
+            database=kwargs["dbname"],
+            min_size=PG_POOL_MIN,
+            max_size=PG_POOL_MAX,
+            server_settings={"statement_timeout": str(PG_STATEMENT_TIMEOUT_MS)},
+        )
+        _async_pools[loop] = pool
+    return pool
+
+
+async def fetch_one_async(query, params=None):
+    """Awaitable fetch_one. Uses asyncpg when installed, else the threaded pool off the event loop."""
+    if asyncpg is None:
+        return await asyncio.to_thread(fetch_one, query, params)
+    sql, args = _to_asyncpg(query, params)
+    pool = await _get_async_pool()
+    row = await pool.fetchrow(sql, *args, timeout=PG_POOL_WAIT_SECONDS + PG_STATEMENT_TIMEOUT_MS / 1000)
+    return dict(row) if row is not None else None
+
+
+async def fetch_all_async(query, params=None):
+    """Awaitable fetch_all. Uses asyncpg when installed, else the threaded pool off the event loop."""
+    if asyncpg is None:
+        return await asyncio.to_thread(fetch_all, query, params)
+    sql, args = _to_asyncpg(query, params)
+    pool = await _get_async_pool()
+    rows = await pool.fetch(sql, *args, timeout=PG_POOL_WAIT_SECONDS + PG_STATEMENT_TIMEOUT_MS / 1000)
+    return [dict(r) for r in rows]
+
+
+async def close_async_pool():
+    """Close the asyncpg pool bound to the running event loop."""
+    pool = _async_pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.close()
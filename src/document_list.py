@@ -1,21 +1,30 @@
-from typing import List, Tuple, Dict, Any
+import os
+import json
+from typing import Iterator, List, Optional, Tuple, Dict, Any
 from langchain.schema import Document
-from .data_layer import fetch_daily_summaries, fetch_reservation, get_PerformanceMonitor, get_annual_summary
+from .data_layer import fetch_daily_summaries, fetch_reservation, stream_daily_summaries, stream_reservation, get_PerformanceMonitor, get_annual_summary, get_annual_summary_months
 from utils.month_normalizer import normalize_month_str, month_num_for_sort
-import uuid
 import pandas as pd
 import calendar
 import re
 from datetime import datetime, timezone
 
+# How Performance Monitor sections become documents: leaf (one per JSON scalar), row (one
+# per row), rows (PM_CHUNK_ROWS rows per compact table) or section (one table per section)
+PM_CHUNKING = os.getenv("PM_CHUNKING", "row")
+PM_CHUNK_ROWS = int(os.getenv("PM_CHUNK_ROWS", "20"))
+# A section table longer than this (characters) is split into PM_CHUNK_ROWS-row chunks
+# to stay well inside the embedding model's input limit
+PM_SECTION_MAX_CHARS = int(os.getenv("PM_SECTION_MAX_CHARS", "24000"))
+PM_CHUNKINGS = ("leaf", "row", "rows", "section")
+
 
 # -----------------------------------------------------------------------------
 # Document Preparation
 # -----------------------------------------------------------------------------
 
-def daily_summaries_docs(propertyCode, AsOfDate) -> Tuple[List[Document], List[Dict[str, Any]], List[str]]:
-    """Convert daily summaries into Document objects, metadata, and IDs."""
-    df = fetch_daily_summaries(propertyCode, AsOfDate)
+def _daily_summaries_batch(propertyCode, df) -> Tuple[List[Document], List[Dict[str, Any]], List[str]]:
+    """Convert a frame of daily summaries into Document objects, metadata, and IDs."""
  
     docs: List[Document] = []
     metadatas: List[Dict[str, Any]] = []
@@ -91,9 +100,8 @@ def daily_summaries_docs(propertyCode, AsOfDate) -> Tuple[List[Document], List[D
  
     return docs, metadatas, ids
  
-def reservation_docs(propertyCode, AsOfDate) -> Tuple[List[Document], List[Dict[str, Any]], List[str]]:
-    """Convert daily summaries into Document objects, metadata, and IDs."""
-    df = fetch_reservation(propertyCode, AsOfDate)
+def _reservation_batch(propertyCode, df) -> Tuple[List[Document], List[Dict[str, Any]], List[str]]:
+    """Convert a frame of reservations into Document objects, metadata, and IDs."""
  
     docs: List[Document] = []
     metadatas: List[Dict[str, Any]] = []
@@ -169,28 +177,64 @@ def reservation_docs(propertyCode, AsOfDate) -> Tuple[List[Document], List[Dict[
  
     return docs, metadatas, ids
  
-def docs_performance_monitor(PROPERTY_ID="", PROPERTY_CODE="", AS_OF_DATE="", CLIENT_ID="",conn= None) -> Tuple[List[Document], List[Dict[str, Any]], List[str]]:
+def daily_summaries_docs(propertyCode, AsOfDate) -> Tuple[List[Document], List[Dict[str, Any]], List[str]]:
+    """Convert daily summaries into Document objects, metadata, and IDs."""
+    return _daily_summaries_batch(propertyCode, fetch_daily_summaries(propertyCode, AsOfDate))
+
+def iter_daily_summaries_docs(propertyCode, AsOfDate, batch_size=None) -> Iterator[Tuple[List[Document], List[Dict[str, Any]], List[str]]]:
+    """Like daily_summaries_docs, one server-side cursor batch at a time."""
+    for df in stream_daily_summaries(propertyCode, AsOfDate, batch_size=batch_size):
+        yield _daily_summaries_batch(propertyCode, df)
+
+def reservation_docs(propertyCode, AsOfDate) -> Tuple[List[Document], List[Dict[str, Any]], List[str]]:
     """Convert daily summaries into Document objects, metadata, and IDs."""
+    return _reservation_batch(propertyCode, fetch_reservation(propertyCode, AsOfDate))
+
+def iter_reservation_docs(propertyCode, AsOfDate, batch_size=None) -> Iterator[Tuple[List[Document], List[Dict[str, Any]], List[str]]]:
+    """Like reservation_docs, one server-side cursor batch at a time."""
+    for df in stream_reservation(propertyCode, AsOfDate, batch_size=batch_size):
+        yield _reservation_batch(propertyCode, df)
+
+def docs_performance_monitor(PROPERTY_ID="", PROPERTY_CODE="", AS_OF_DATE="", CLIENT_ID="",conn= None, sections=None, payload=None, chunking: Optional[str] = None) -> Tuple[List[Document], List[Dict[str, Any]], List[str]]:
+    """
+    Convert Performance Monitor sections into Document objects, metadata, and IDs.
+    `payload` is an already fetched `(response_json, error_list)`, e.g. from
+    get_PerformanceMonitor_async; `conn` is not used then. `chunking` is one of
+    PM_CHUNKINGS (default PM_CHUNKING).
+    """
+    chunking = chunking or PM_CHUNKING
+    if chunking not in PM_CHUNKINGS:
+        raise ValueError(f"Unknown chunking '{chunking}'. Valid values: {', '.join(PM_CHUNKINGS)}")
 
-    response_json, error_list = get_PerformanceMonitor(PROPERTY_ID=PROPERTY_ID, PROPERTY_CODE=PROPERTY_CODE, AS_OF_DATE=AS_OF_DATE, CLIENT_ID=CLIENT_ID, conn=conn)
+    if payload is None:
+        payload = get_PerformanceMonitor(PROPERTY_ID=PROPERTY_ID, PROPERTY_CODE=PROPERTY_CODE, AS_OF_DATE=AS_OF_DATE, CLIENT_ID=CLIENT_ID, conn=conn, sections=sections)
+    response_json, error_list = payload
 
     docs: List[Document] = []
     metadatas: List[Dict[str, Any]] = []
     ids: List[str] = []
 
         # --- build documents ---
-    for text, meta in traverse_json(response_json):
-        uid = str(uuid.uuid4())
-        doc = Document(page_content=text, metadata={
-            "property_id": PROPERTY_ID,
-            "property_code": PROPERTY_CODE,
-            "as_of_date": AS_OF_DATE,
-            "client_id": CLIENT_ID,
-            **meta
-        })
-        docs.append(doc)
-        metadatas.append(doc.metadata)
-        ids.append(uid)
+    for section, section_rows in (response_json or {}).items():
+        chunks = traverse_json(section_rows, section) if chunking == "leaf" else chunk_section(section_rows, section, chunking)
+        for text, meta in chunks:
+            # Deterministic: re-ingesting a snapshot overwrites its documents instead of duplicating them
+            uid = f"performance_monitor_{PROPERTY_CODE}_{AS_OF_DATE}_{meta['path']}"
+            if chunking != "leaf":
+                text = f"Performance Monitor {section} for property {PROPERTY_CODE} as of {AS_OF_DATE}:\n{text}"
+            doc = Document(page_content=text, metadata={
+                **meta,
+                "type": "performance_monitor",
+                "property_id": PROPERTY_ID,
+                "property_code": PROPERTY_CODE,
+                "as_of_date": AS_OF_DATE,
+                "client_id": CLIENT_ID,
+                "section": section,
+                "chunking": chunking,
+            })
+            docs.append(doc)
+            metadatas.append(doc.metadata)
+            ids.append(uid)
 
     return docs, metadatas, ids
 
@@ -200,12 +244,14 @@ def docs_annual_summary(
     AS_OF_DATE: str,
     CLIENT_ID: str,
     conn,
+    since_as_of_date: str = None,
 ):
     """
     Build LangChain Documents for the Annual Summary collection.
     Ensures correct year/month parsing and embeds all key metrics.
+    With `since_as_of_date`, only months that changed since that snapshot get documents.
     """
-    df, errs = get_annual_summary(PROPERTY_ID, PROPERTY_CODE, AS_OF_DATE, CLIENT_ID, conn)
+    df, errs = get_annual_summary(PROPERTY_ID, PROPERTY_CODE, AS_OF_DATE, CLIENT_ID, conn, since_as_of_date=since_as_of_date)
     if errs or df is None or df.empty:
         return [], [], []
 
@@ -316,6 +362,14 @@ def docs_annual_summary(
 
     return docs, metadatas, ids
 
+def annual_summary_months(PROPERTY_CODE: str, AS_OF_DATE: str, conn) -> set:
+    """The snapshot's (year, month) keys, in the form docs_annual_summary writes to metadata."""
+    return {
+        (int(row["year"]), str(normalize_month_str(row["month"])).capitalize())
+        for row in get_annual_summary_months(PROPERTY_CODE, AS_OF_DATE, conn)
+        if row.get("year") is not None and row.get("month") is not None
+    }
+
 def traverse_json(obj, parent_key=""):
     """
     Recursively walk nested JSON and yield (text, metadata) pairs.
@@ -332,4 +386,51 @@ def traverse_json(obj, parent_key=""):
         # leaf node → convert into text + metadata
         yield str(obj), {"path": parent_key}
 
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str, separators=(",", ":"))
+    return str(value)
+
+def _table(rows: List[Dict[str, Any]]) -> str:
+    """Rows as a compact pipe-separated table; the columns are the union of the row keys."""
+    columns = list(dict.fromkeys(k for row in rows for k in row))
+    lines = [" | ".join(columns)]
+    lines.extend(" | ".join(_cell(row.get(c)) for c in columns) for row in rows)
+    return "\n".join(lines)
+
+def chunk_section(payload, section: str, chunking: str = "row", rows_per_chunk: Optional[int] = None):
+    """
+    Yield (text, metadata) chunks of one Performance Monitor section.
+
+    row: one document per row, as `key: value` pairs, with the row's scalar fields
+    also in the metadata (so filters like {"Dates": ...} work). rows: compact tables
+    of `rows_per_chunk` rows. section: one table for the whole section, split like
+    rows when longer than PM_SECTION_MAX_CHARS. Sections that are not a list of
+    objects become a single document.
+    """
+    rows_per_chunk = rows_per_chunk or PM_CHUNK_ROWS
+    if not isinstance(payload, list) or not all(isinstance(row, dict) for row in payload):
+        if payload in (None, [], {}):
+            return
+        yield _cell(payload), {"path": section}
+        return
+
+    if chunking == "row":
+        for i, row in enumerate(payload):
+            text = "; ".join(f"{k}: {_cell(v)}" for k, v in row.items() if v is not None)
+            meta = {k: v for k, v in row.items() if isinstance(v, (str, int, float, bool))}
+            yield text, {**meta, "path": f"{section}[{i}]", "row": i}
+        return
+
+    if chunking == "section":
+        table = _table(payload)
+        if len(table) <= PM_SECTION_MAX_CHARS:
+            if payload:
+                yield table, {"path": section, "row_start": 0, "row_end": len(payload)}
+            return
 
+    for start in range(0, len(payload), rows_per_chunk):
+        end = min(start + rows_per_chunk, len(payload))
+        yield _table(payload[start:end]), {"path": f"{section}[{start}:{end}]", "row_start": start, "row_end": end}
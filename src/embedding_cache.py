@@ -0,0 +1,190 @@
+# src/embedding_cache.py
+"""
+Content-addressed cache of document embeddings, shared by every ingest.
+
+Most documents of a re-ingest are byte-identical to the previous run's (past
+annual-summary months, unchanged Performance Monitor leaves), so their vectors
+are looked up by (embedding model, sha256(text)) instead of being sent to the
+embeddings API again. Only the misses are embedded, in one call.
+
+Vectors are stored as float32 in a single SQLite file bounded by
+EMBEDDING_CACHE_MAX_BYTES; the least recently used entries are evicted first.
+`CachedEmbeddings` wraps any LangChain embeddings object, so a Chroma store built
+with it caches on every add_texts.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+from langchain_core.embeddings import Embeddings
+
+from utils.logger import get_custom_logger
+
+logger = get_custom_logger(name="embedding_cache")
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "/tmp/embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# SQLite's default limit on host parameters per statement is 999
+_LOOKUP_CHUNK = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model       TEXT NOT NULL,
+    text_hash   TEXT NOT NULL,
+    vector      BLOB NOT NULL,
+    size        INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (model, text_hash)
+);
+CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_access);
+"""
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def model_name(embeddings) -> str:
+    """Cache namespace of an embeddings object: its model, or its class when it has none."""
+    return str(getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None) or type(embeddings).__name__)
+
+
+class EmbeddingCache:
+    """Size-bounded LRU store of vectors, shared by every thread of the process."""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def get_many(self, model: str, hashes: Sequence[str]) -> Dict[str, List[float]]:
+        """Cached vectors for the given text hashes; missing hashes are absent from the result."""
+        wanted = list(dict.fromkeys(hashes))
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for start in range(0, len(wanted), _LOOKUP_CHUNK):
+                chunk = wanted[start:start + _LOOKUP_CHUNK]
+                placeholders = ", ".join("?" * len(chunk))
+                for h, blob in self._db.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model=? AND text_hash IN ({placeholders})",
+                    (model, *chunk),
+                ):
+                    found[h] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE embeddings SET last_access=? WHERE model=? AND text_hash=?",
+                    [(now, model, h) for h in found],
+                )
+            self.hits += len(found)
+            self.misses += len(wanted) - len(found)
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, Sequence[float]]) -> None:
+        now = time.time()
+        rows = []
+        for h, vector in vectors.items():
+            blob = array("f", vector).tobytes()
+            rows.append((model, h, blob, len(blob), now))
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+                self._evict()
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _evict(self) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for rowid, size in self._db.execute("SELECT rowid, size FROM embeddings ORDER BY last_access"):
+            victims.append((rowid,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self._db.executemany("DELETE FROM embeddings WHERE rowid=?", victims)
+        self.evictions += len(victims)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Process-wide cache, or None when disabled or the cache file can't be opened."""
+    global _cache, EMBEDDING_CACHE_ENABLED
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = EmbeddingCache()
+            except Exception as e:
+                logger.warning(f"Embedding cache disabled, cannot open {EMBEDDING_CACHE_PATH}: {e}")
+                EMBEDDING_CACHE_ENABLED = False
+                return None
+        return _cache
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings that serve documents from the content-hash cache and only send the
+    misses to `embeddings`. Queries are passed through uncached.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self.model = model_name(embeddings)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        cache = get_embedding_cache()
+        if cache is None or not texts:
+            return self.embeddings.embed_documents(texts)
+
+        hashes = [text_hash(t) for t in texts]
+        try:
+            vectors = cache.get_many(self.model, hashes)
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed, embedding everything: {e}")
+            return self.embeddings.embed_documents(texts)
+
+        missing = {h: t for h, t in zip(hashes, texts) if h not in vectors}
+        if missing:
+            fresh = dict(zip(missing, self.embeddings.embed_documents(list(missing.values()))))
+            vectors.update(fresh)
+            try:
+                cache.put_many(self.model, fresh)
+            except Exception as e:
+                logger.warning(f"Could not store {len(fresh)} embeddings in the cache: {e}")
+        logger.info(f"Embeddings for {len(texts)} texts: {len(texts) - len(missing)} cached, {len(missing)} embedded")
+        return [vectors[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
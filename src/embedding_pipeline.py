@@ -0,0 +1,221 @@
+# src/embedding_pipeline.py
+"""
+Batched, concurrent, rate-limited embedding for ingest.
+
+`add_texts_pipelined` replaces a single `chroma.add_texts` call. It splits the
+texts into batches bounded by EMBED_BATCH_TOKENS and EMBED_BATCH_SIZE, embeds up to
+EMBED_CONCURRENCY batches at once, and writes each batch to the vector store as
+soon as its vectors are back while later batches are still in flight.
+
+`RateLimitedEmbeddings` wraps the embeddings client and is the one place that
+talks to the API: every request waits for the shared requests/tokens-per-minute
+budget (EMBED_RPM / EMBED_TPM) and is retried with exponential backoff on rate
+limits and transient errors. Wrapped by CachedEmbeddings, only cache misses are
+charged against the budget.
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from utils.logger import get_custom_logger
+
+try:
+    import tiktoken
+except ImportError:  # optional: token counts fall back to a characters / 4 estimate
+    tiktoken = None
+
+logger = get_custom_logger(name="embedding_pipeline")
+
+# Upper bounds of one embeddings request
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "50000"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+# Embedding requests in flight per ingest
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+# Process-wide API budget, shared by every ingest
+EMBED_RPM = int(os.getenv("EMBED_RPM", "3000"))
+EMBED_TPM = int(os.getenv("EMBED_TPM", "1000000"))
+# Retries of a rate-limited or failed request, with exponential backoff capped at EMBED_BACKOFF_MAX seconds
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+EMBED_BACKOFF_MAX = float(os.getenv("EMBED_BACKOFF_MAX", "60"))
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_RETRYABLE_ERRORS = {"RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError", "Timeout"}
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Tokens of `text` for the embedding model (cl100k_base), or an estimate without tiktoken."""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def token_batches(texts: Sequence[str], max_tokens: Optional[int] = None, max_size: Optional[int] = None) -> Iterator[Tuple[int, int, int]]:
+    """
+    Split `texts` into consecutive `(start, end, tokens)` ranges of at most
+    `max_tokens` tokens and `max_size` texts. A single text over the token bound
+    gets a batch of its own.
+    """
+    max_tokens = max_tokens or EMBED_BATCH_TOKENS
+    max_size = max_size or EMBED_BATCH_SIZE
+    start, tokens = 0, 0
+    for i, text in enumerate(texts):
+        n = count_tokens(text)
+        if i > start and (tokens + n > max_tokens or i - start >= max_size):
+            yield start, i, tokens
+            start, tokens = i, 0
+        tokens += n
+    if start < len(texts):
+        yield start, len(texts), tokens
+
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute, shared by all threads."""
+
+    def __init__(self, rpm: int = EMBED_RPM, tpm: int = EMBED_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def acquire(self, tokens: int) -> None:
+        """Block until one request of `tokens` tokens fits in the budget."""
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                delay = max(
+                    (1 - self._requests) * 60 / self.rpm if self._requests < 1 else 0,
+                    (tokens - self._tokens) * 60 / self.tpm if self._tokens < tokens else 0,
+                )
+                self.waited += delay
+            time.sleep(delay)
+
+
+_limiter = RateLimiter()
+
+
+def _retryable(e: Exception) -> bool:
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    return status in _RETRYABLE_STATUS or type(e).__name__ in _RETRYABLE_ERRORS
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """Embeddings whose API requests respect the shared RPM/TPM budget and are retried with backoff."""
+
+    def __init__(self, embeddings: Embeddings, limiter: Optional[RateLimiter] = None):
+        self.embeddings = embeddings
+        self.limiter = limiter or _limiter
+        # Same cache namespace as the wrapped client (see embedding_cache.model_name)
+        self.model = getattr(embeddings, "model", None) or type(embeddings).__name__
+
+    def _call(self, fn, texts: List[str]):
+        tokens = sum(count_tokens(t) for t in texts)
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            self.limiter.acquire(tokens)
+            try:
+                return fn()
+            except Exception as e:
+                if attempt == EMBED_MAX_RETRIES or not _retryable(e):
+                    raise
+                delay = _retry_after(e) or min(EMBED_BACKOFF_MAX, 2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning(f"Embedding request failed ({type(e).__name__}: {e}), retry {attempt + 1}/{EMBED_MAX_RETRIES} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._call(lambda: self.embeddings.embed_documents(texts), texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._call(lambda: self.embeddings.embed_query(text), [text])
+
+
+def upsert_records(store, ids, texts, vectors, metadatas) -> None:
+    # Chroma rejects empty metadata dicts; upsert those documents without metadata, like add_texts
+    with_meta = [i for i, m in enumerate(metadatas) if m]
+    without_meta = [i for i, m in enumerate(metadatas) if not m]
+    for indices, has_meta in ((with_meta, True), (without_meta, False)):
+        if indices:
+            store.upsert(
+                ids=[ids[i] for i in indices],
+                embeddings=[vectors[i] for i in indices],
+                documents=[texts[i] for i in indices],
+                **({"metadatas": [metadatas[i] for i in indices]} if has_meta else {}),
+            )
+
+
+def add_texts_pipelined(store, texts: Sequence[str], metadatas: Optional[Sequence[Dict[str, Any]]] = None, ids: Optional[Sequence[str]] = None, concurrency: Optional[int] = None) -> int:
+    """
+    Embed and upsert `texts` into `store` (a vector_store.VectorStore) batch by
+    batch: up to `concurrency` embedding requests in flight, each batch written as
+    soon as it is embedded. Same semantics as chroma.add_texts with explicit ids;
+    returns the texts written.
+    """
+    texts = list(texts)
+    if not texts:
+        return 0
+    metadatas = list(metadatas) if metadatas is not None else [{}] * len(texts)
+    if ids is None:
+        raise ValueError("add_texts_pipelined needs explicit ids")
+    ids = list(ids)
+    concurrency = max(1, concurrency or EMBED_CONCURRENCY)
+    embeddings = store.embeddings
+
+    started = time.perf_counter()
+    batches = iter(token_batches(texts))
+    written = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed") as pool:
+        in_flight = {}
+
+        def submit():
+            batch = next(batches, None)
+            if batch is not None:
+                start, end, _ = batch
+                in_flight[pool.submit(embeddings.embed_documents, texts[start:end])] = (start, end)
+            return batch is not None
+
+        for _ in range(concurrency):
+            if not submit():
+                break
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                start, end = in_flight.pop(future)
+                vectors = future.result()
+                # Keep the next batch embedding while this one is written
+                submit()
+                upsert_records(store, ids[start:end], texts[start:end], vectors, metadatas[start:end])
+                written += end - start
+
+    logger.info(f"Embedded and wrote {written} texts to {store.name} in {time.perf_counter() - started:.2f}s")
+    return written
@@ -0,0 +1,118 @@
+# src/portfolio.py
+"""
+Fan a data_layer fetch out over many property databases of one client.
+
+Every property lives in its own Postgres database. Fetching a whole portfolio
+property by property pays one master DB lookup and one engine per call. Here all
+DSNs are resolved with a single master query (db_config.prime_tenants). The
+properties are then fetched concurrently, at most PORTFOLIO_WORKERS at a time.
+Each one uses a pooled connection from its database's engine in the shared registry.
+
+    results = fetch_portfolio("42", {"AC32AW": "11", "BX19KL": "12"}, "performance_monitor", "2025-10-09")
+    for code, r in results.items():
+        print(code, r.seconds, len(r.error_list))
+"""
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Union
+
+from src.db_config import get_engine, prime_tenants
+from src.data_layer import fetch_daily_summaries, fetch_reservation, get_annual_summary, get_PerformanceMonitor
+from utils.logger import get_custom_logger
+
+logger = get_custom_logger(name="portfolio")
+
+# Properties fetched at once. Each may run up to PM_SECTION_WORKERS sections of its own.
+PORTFOLIO_WORKERS = int(os.getenv("PORTFOLIO_WORKERS", "8"))
+
+
+@dataclass
+class PropertyFetch:
+    """Outcome of one property's fetch: the fetcher's result, its errors and wall time."""
+    property_code: str
+    result: Any = None
+    error_list: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.result is not None and not self.error_list
+
+
+def _daily_summary(PROPERTY_ID, PROPERTY_CODE, AS_OF_DATE, CLIENT_ID, conn):
+    return fetch_daily_summaries(PROPERTY_CODE, AS_OF_DATE, conn=conn), []
+
+def _reservation(PROPERTY_ID, PROPERTY_CODE, AS_OF_DATE, CLIENT_ID, conn):
+    return fetch_reservation(PROPERTY_CODE, AS_OF_DATE, conn=conn), []
+
+# Fetchers take (PROPERTY_ID, PROPERTY_CODE, AS_OF_DATE, CLIENT_ID, conn, **options)
+# and return (result, error_list), like get_PerformanceMonitor
+FETCHERS: Dict[str, Callable] = {
+    "performance_monitor": get_PerformanceMonitor,
+    "annual_summary": get_annual_summary,
+    "daily_summary": _daily_summary,
+    "reservation": _reservation,
+}
+
+
+def _fetch_one(fetcher, clientId, property_code, property_id, as_of_date, options) -> PropertyFetch:
+    outcome = PropertyFetch(property_code)
+    started = time.perf_counter()
+    try:
+        with get_engine(property_code, clientId).connect() as conn:
+            outcome.result, errors = fetcher(property_id, property_code, as_of_date, clientId, conn, **options)
+        outcome.error_list.extend(errors or [])
+    except Exception as e:
+        outcome.error_list.append(f"Error fetching property '{property_code}': {str(e)}\nTraceback:\n{traceback.format_exc()}")
+    outcome.seconds = time.perf_counter() - started
+    return outcome
+
+
+def fetch_portfolio(
+    clientId,
+    properties: Union[Mapping[str, Any], Iterable[str]],
+    fetcher: Union[str, Callable],
+    as_of_date: str,
+    max_workers: Optional[int] = None,
+    **options,
+) -> Dict[str, PropertyFetch]:
+    """
+    Run `fetcher` (a FETCHERS name or a callable with the same signature) for each
+    property of `clientId`. `properties` is a list of property codes or a
+    {property_code: property_id} mapping; `options` go to the fetcher (e.g. `sections`).
+
+    Returns a PropertyFetch per property code, in the order given. A property whose
+    database can't be resolved or reached gets an error entry; the others still run.
+    """
+    if isinstance(fetcher, str):
+        if fetcher not in FETCHERS:
+            raise ValueError(f"Unknown fetcher '{fetcher}'. Valid fetchers: {', '.join(FETCHERS)}")
+        fetcher = FETCHERS[fetcher]
+    ids = dict(properties) if isinstance(properties, Mapping) else dict.fromkeys(properties, "")
+    max_workers = max_workers or PORTFOLIO_WORKERS
+    started = time.perf_counter()
+
+    results: Dict[str, PropertyFetch] = {}
+    try:
+        for code in prime_tenants(list(ids), clientId):
+            results[code] = PropertyFetch(code, error_list=[f"No configuration found for property '{code}' and clientId '{clientId}'"])
+    except Exception as e:
+        # Per-property lookups still work (and still use the descriptor cache)
+        logger.warning(f"Bulk tenant lookup failed for client {clientId}, resolving properties one by one: {e}")
+
+    pending = [code for code in ids if code not in results]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending) or 1)), thread_name_prefix="portfolio") as pool:
+        futures = [pool.submit(_fetch_one, fetcher, clientId, code, ids[code], as_of_date, options) for code in pending]
+        for future in as_completed(futures):
+            outcome = future.result()
+            results[outcome.property_code] = outcome
+
+    failed = sum(1 for r in results.values() if r.error_list)
+    logger.info(
+        f"Portfolio fetch for client {clientId}: {len(ids)} properties in {time.perf_counter() - started:.2f}s"
+        f" ({failed} with errors, {max_workers} workers)"
+    )
+    return {code: results[code] for code in ids}
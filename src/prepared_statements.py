@@ -0,0 +1,154 @@
+# src/prepared_statements.py
+"""
+Per-connection prepared-statement cache for bind-parameterized queries.
+
+psycopg2 interpolates parameters on the client, so every execution of a query is
+parsed and planned again by Postgres. Here a single-statement query with `:name`
+binds is PREPAREd once per pooled DBAPI connection and then run with EXECUTE, which
+lets Postgres reuse the plan across properties and snapshots.
+
+Statement names are derived from the SQL text, and the cache lives in the DBAPI
+connection's `info` dict, so it survives pool check-in/check-out and dies with the
+connection. A statement the server no longer knows (SQLSTATE 26000) empties that
+cache, so everything is prepared again on next use. Anything that can't be prepared (DO blocks, multi-statement scripts,
+missing params) runs as a plain statement, and so does everything on asyncpg
+connections, which already prepare and cache statements in the driver.
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+from utils.logger import get_custom_logger
+
+logger = get_custom_logger(name="prepared_statements")
+
+# Prepared statements kept per connection; the least recently used is DEALLOCATEd
+PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("PREPARED_STATEMENT_CACHE_SIZE", "64"))
+
+# Same bind syntax sqlalchemy.text() recognizes: `:name`, but not `::type` casts
+_BIND_RE = re.compile(r"(?<![:\w\\]):(\w+)(?!:)")
+
+# SQLSTATE invalid_sql_statement_name: the statement vanished (DISCARD ALL, failover)
+_MISSING_STATEMENT = "26000"
+
+_INFO_KEY = "rmc_prepared_statements"
+
+_stats = {"prepared": 0, "executed": 0, "plain": 0, "deallocated": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key: str) -> None:
+    with _stats_lock:
+        _stats[key] += 1
+
+
+@lru_cache(maxsize=512)
+def prepared_form(query: str) -> Optional[Tuple[str, str, Tuple[str, ...]]]:
+    """`(statement name, SQL with $n placeholders, bind names in $n order)`, or None."""
+    body = query.strip().rstrip(";").strip()
+    if not body or ";" in body or re.match(r"DO\b", body, re.I):
+        return None
+
+    names = []
+
+    def positional(m):
+        name = m.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    sql = _BIND_RE.sub(positional, body)
+    if not names:
+        return None
+    digest = hashlib.sha1(sql.encode("utf-8")).hexdigest()[:16]
+    return f"rmc_stmt_{digest}", sql, tuple(names)
+
+
+def _statements(conn) -> "OrderedDict[str, bool]":
+    return conn.connection.info.setdefault(_INFO_KEY, OrderedDict())
+
+
+def _driver(conn) -> Optional[str]:
+    return getattr(getattr(conn, "dialect", None), "driver", "psycopg2")
+
+
+def _pgcode(e) -> Optional[str]:
+    return getattr(getattr(e, "orig", None), "pgcode", None)
+
+
+def _prepare(conn, name: str, sql: str) -> bool:
+    statements = _statements(conn)
+    if name in statements:
+        statements.move_to_end(name)
+        return statements[name]
+    try:
+        with conn.begin_nested():
+            # no_parameters: hand the SQL to the driver untouched (no %-formatting)
+            conn.exec_driver_sql(f"PREPARE {name} AS {sql}", execution_options={"no_parameters": True})
+        ok = True
+        _count("prepared")
+    except Exception as e:
+        # Remember the failure so the statement isn't re-parsed on every call
+        logger.warning(f"Could not prepare {name}, running it unprepared: {e}")
+        ok = False
+    statements[name] = ok
+    while len(statements) > PREPARED_STATEMENT_CACHE_SIZE:
+        old, was_prepared = statements.popitem(last=False)
+        if was_prepared:
+            try:
+                with conn.begin_nested():
+                    conn.exec_driver_sql(f"DEALLOCATE {old}")
+                _count("deallocated")
+            except Exception:
+                pass
+    return ok
+
+
+def execute_prepared(conn, query: str, params: Optional[Dict[str, Any]] = None):
+    """
+    Drop-in for `conn.execute(text(query), params)` that goes through the
+    connection's prepared statement when the query can be prepared.
+    """
+    params = params or {}
+    form = prepared_form(query) if _driver(conn) == "psycopg2" else None
+    if form is None or any(name not in params for name in form[2]) or not _prepare(conn, form[0], form[1]):
+        _count("plain")
+        return conn.execute(text(query), params)
+
+    name, sql, names = form
+    statement = text(f"EXECUTE {name}({', '.join(f':{n}' for n in names)})")
+    bound = {n: params[n] for n in names}
+    # No savepoint per EXECUTE: only the one-time PREPARE pays for one
+    fresh = not conn.in_transaction()
+    try:
+        result = conn.execute(statement, bound)
+    except Exception as e:
+        if _pgcode(e) != _MISSING_STATEMENT:
+            raise
+        # The session lost its prepared statements (DISCARD ALL, a pooler switching
+        # backends); forget all of them so they are prepared again on next use
+        logger.warning(f"Prepared statement {name} vanished, re-preparing")
+        _statements(conn).clear()
+        if not fresh:
+            # The caller's transaction is aborted now; its savepoint or retry re-prepares
+            raise
+        # The failed EXECUTE began the transaction, so nothing of the caller's is lost
+        conn.rollback()
+        if not _prepare(conn, name, sql):
+            _count("plain")
+            return conn.execute(text(query), params)
+        result = conn.execute(statement, bound)
+    _count("executed")
+    return result
+
+
+def stats() -> Dict[str, int]:
+    """Process-wide prepare/execute counters."""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,202 @@
+# src/result_cache.py
+"""
+Disk-backed cache of Performance Monitor section results.
+
+A section's rows for one snapshot don't change once the nightly load is done, so
+re-ingests and backfills can reuse them instead of re-running the query. Entries are
+keyed by (tenant DB, property, as_of, section, query version) where the query version
+is a checksum of the exact SQL and params that produced them, so code changes never
+serve stale shapes.
+
+Several sections read the latest snapshot (MAX("AsOfDate")) rather than the requested
+one, so every entry of a property is dropped as soon as a newer AsOfDate shows up in
+dailydata_transaction (see `invalidate_on_new_snapshot`).
+
+The store is a single SQLite file bounded by PM_RESULT_CACHE_MAX_BYTES; the least
+recently used entries are evicted first.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from utils.logger import get_custom_logger
+
+logger = get_custom_logger(name="result_cache")
+
+PM_RESULT_CACHE_ENABLED = os.getenv("PM_RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+PM_RESULT_CACHE_PATH = os.getenv("PM_RESULT_CACHE_PATH", "/tmp/pm_result_cache.sqlite3")
+PM_RESULT_CACHE_MAX_BYTES = int(os.getenv("PM_RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Bump when the shape of the cached rows changes; entries of older formats are never read
+ROW_FORMAT = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS section_results (
+    database      TEXT NOT NULL,
+    property_code TEXT NOT NULL,
+    as_of         TEXT NOT NULL,
+    section       TEXT NOT NULL,
+    query_version TEXT NOT NULL,
+    payload       TEXT NOT NULL,
+    size          INTEGER NOT NULL,
+    last_access   REAL NOT NULL,
+    PRIMARY KEY (database, property_code, as_of, section, query_version)
+);
+CREATE INDEX IF NOT EXISTS section_results_lru ON section_results (last_access);
+CREATE TABLE IF NOT EXISTS snapshot_watermarks (
+    database       TEXT NOT NULL,
+    property_code  TEXT NOT NULL,
+    latest_as_of   TEXT NOT NULL,
+    PRIMARY KEY (database, property_code)
+);
+"""
+
+
+def query_version(query: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Checksum of the SQL and bind params a section ran with."""
+    digest = hashlib.sha256(f"{ROW_FORMAT}:{query}".encode("utf-8"))
+    digest.update(json.dumps(params or {}, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def database_name(conn) -> str:
+    url = conn.engine.url
+    return f"{url.host}:{url.port}/{url.database}"
+
+
+class SectionResultCache:
+    """Size-bounded LRU store of section rows, shared by every thread of the process."""
+
+    def __init__(self, path: str = PM_RESULT_CACHE_PATH, max_bytes: int = PM_RESULT_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def get(self, database: str, property_code: str, as_of: str, section: str, version: str) -> Optional[List[Dict[str, Any]]]:
+        key = (database, property_code, str(as_of), section, version)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT payload FROM section_results WHERE database=? AND property_code=? AND as_of=? AND section=? AND query_version=?",
+                key,
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE section_results SET last_access=? WHERE database=? AND property_code=? AND as_of=? AND section=? AND query_version=?",
+                (time.time(), *key),
+            )
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, database: str, property_code: str, as_of: str, section: str, version: str, rows: List[Dict[str, Any]]) -> None:
+        payload = json.dumps(rows, default=str)
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO section_results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (database, property_code, str(as_of), section, version, payload, size, time.time()),
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM section_results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for rowid, size in self._db.execute("SELECT rowid, size FROM section_results ORDER BY last_access"):
+            victims.append((rowid,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self._db.executemany("DELETE FROM section_results WHERE rowid=?", victims)
+        self.evictions += len(victims)
+
+    def invalidate(self, database: Optional[str] = None, property_code: Optional[str] = None, as_of: Optional[str] = None) -> int:
+        """Drop every entry matching the given key parts (all entries when none are given)."""
+        clauses, args = [], []
+        for column, value in (("database", database), ("property_code", property_code), ("as_of", as_of)):
+            if value is not None:
+                clauses.append(f"{column}=?")
+                args.append(str(value))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            removed = self._db.execute(f"DELETE FROM section_results{where}", args).rowcount
+            self.invalidations += removed
+        return removed
+
+    def invalidate_on_new_snapshot(self, conn, database: str, property_code: str) -> bool:
+        """
+        Invalidation hook: compare the property's latest AsOfDate in dailydata_transaction
+        with the one recorded last time, and drop the property's entries if it moved.
+        Returns True when entries were invalidated.
+        """
+        with conn.begin_nested():
+            latest = conn.execute(
+                text('SELECT MAX("AsOfDate") FROM dailydata_transaction WHERE "propertyCode" = :property_code'),
+                {"property_code": property_code},
+            ).scalar()
+        latest = str(latest) if latest is not None else ""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT latest_as_of FROM snapshot_watermarks WHERE database=? AND property_code=?",
+                (database, property_code),
+            ).fetchone()
+            if row is not None and row[0] == latest:
+                return False
+            self._db.execute(
+                "INSERT OR REPLACE INTO snapshot_watermarks VALUES (?, ?, ?)",
+                (database, property_code, latest),
+            )
+        if row is None:
+            return False
+        removed = self.invalidate(database=database, property_code=property_code)
+        logger.info(f"New snapshot {latest} for {property_code} on {database}: dropped {removed} cached sections")
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM section_results").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+_cache: Optional[SectionResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[SectionResultCache]:
+    """Process-wide cache, or None when disabled or the cache file can't be opened."""
+    global _cache, PM_RESULT_CACHE_ENABLED
+    if not PM_RESULT_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = SectionResultCache()
+            except Exception as e:
+                logger.warning(f"Section result cache disabled, cannot open {PM_RESULT_CACHE_PATH}: {e}")
+                PM_RESULT_CACHE_ENABLED = False
+                return None
+        return _cache
@@ -0,0 +1,351 @@
+# src/sql_functions.py
+"""
+Server-side SQL function library for the Performance Monitor DO blocks.
+
+The plpgsql source of every function is rendered from the same section builders
+data_layer uses for its anonymous DO blocks, so there is a single copy of the SQL.
+Each installed function is recorded in `rmc_function_versions` with a checksum of
+its DDL; data_layer only calls a function whose installed version matches the
+code, and falls back to the DO block otherwise.
+
+Usage:
+    python -m src.sql_functions status  --property-code AC32AW
+    python -m src.sql_functions install --property-code AC32AW [--force]
+    python -m src.sql_functions render  [--function rmc_low_demand_dates]
+"""
+import argparse
+import hashlib
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from utils.logger import get_custom_logger
+
+logger = get_custom_logger(name="sql_functions")
+
+# Bump when the rendering scheme itself changes (signature, return type, wrapper)
+LIBRARY_VERSION = 2
+
+VERSIONS_TABLE = "rmc_function_versions"
+
+# How long a database's installed-version lookup is trusted before re-reading it
+INSTALLED_CACHE_TTL = 300
+
+# Builders are rendered with these placeholders, then each quoted placeholder is
+# swapped for the matching function argument.
+_PLACEHOLDERS = {
+    "PROPERTY_ID": "__rmc_property_id__",
+    "PROPERTY_CODE": "__rmc_property_code__",
+    "AS_OF_DATE": "__rmc_as_of__",
+    "start_date": "__rmc_as_of__",
+    "end_date": "__rmc_as_of__",
+}
+_ARGUMENTS = {
+    "__rmc_property_id__": "p_property_id",
+    "__rmc_property_code__": "p_property_code",
+    "__rmc_as_of__": "p_as_of",
+}
+SIGNATURE = "p_property_id integer, p_property_code text, p_as_of date"
+
+_DO_BLOCK_RE = re.compile(
+    r"DO\s*\$\$(?P<block>.*)\$\$(?:\s*LANGUAGE\s+plpgsql)?\s*;(?P<tail>.*)$",
+    re.S | re.I,
+)
+_BLOCK_END_RE = re.compile(r"END\s*$", re.I)
+_ORDER_BY_RE = re.compile(r"\border\s+by\b", re.I)
+_LIMIT_RE = re.compile(r"\s+limit\s+(?P<limit>\d+)\s*$", re.I)
+
+# The trailing SELECT is materialized, then returned one json object per row in the
+# shape data_layer._convert_column gives the DO block's rows: dates and timestamps as
+# 'YYYY-MM-DD', numerics with a decimal point so they load as floats, columns in
+# order. The rows are numbered by the tail's ORDER BY and returned in that order.
+_RETURN_ROWS = """
+    DROP TABLE IF EXISTS rmc_result;
+    CREATE TEMP TABLE rmc_result AS
+__select__;
+
+    DECLARE
+        rmc_columns text;
+    BEGIN
+        SELECT string_agg(format('%s AS %I', CASE
+                   WHEN a.atttypid IN ('date'::regtype, 'timestamp'::regtype, 'timestamptz'::regtype)
+                       THEN format('to_char(t.%I, ''YYYY-MM-DD'')', a.attname)
+                   WHEN a.atttypid = 'numeric'::regtype
+                       THEN format('round(t.%1$I, greatest(scale(t.%1$I), 1))', a.attname)
+                   ELSE format('t.%I', a.attname)
+               END, a.attname), ', ' ORDER BY a.attnum)
+          INTO rmc_columns
+          FROM pg_attribute a
+         WHERE a.attrelid = 'pg_temp.rmc_result'::regclass AND a.attnum > 0 AND NOT a.attisdropped;
+
+        RETURN QUERY EXECUTE
+            'SELECT to_json(r) FROM (SELECT *, row_number() OVER (__over__) AS rmc_ord FROM pg_temp.rmc_result) t'
+            || ' CROSS JOIN LATERAL (SELECT ' || rmc_columns || ') r ORDER BY t.rmc_ord__limit__';
+    END;
+
+    DROP TABLE rmc_result;
+"""
+
+
+def _split_order_by(tail: str) -> Tuple[str, str, str]:
+    """`(SELECT, ORDER BY expressions, LIMIT)` of a trailing SELECT; missing parts are ""."""
+    limit = ""
+    m = _LIMIT_RE.search(tail)
+    if m:
+        tail, limit = tail[:m.start()], m.group("limit")
+    # The last ORDER BY outside any parentheses (not a window's or a subquery's)
+    top_level = [m for m in _ORDER_BY_RE.finditer(tail) if tail[:m.start()].count("(") == tail[:m.start()].count(")")]
+    if not top_level:
+        return tail.rstrip(), "", limit
+    m = top_level[-1]
+    return tail[:m.start()].rstrip(), tail[m.end():].strip(), limit
+
+
+def split_do_block(sql: str) -> Optional[Tuple[str, str]]:
+    """`(DO statement, trailing SQL)` for a DO-block script, or None for anything else."""
+    m = _DO_BLOCK_RE.search(sql)
+    if not m or sql[:m.start()].strip():
+        return None
+    return sql[:m.start("tail")].strip(), m.group("tail").strip().rstrip(";").strip()
+
+
+@dataclass(frozen=True)
+class SqlFunction:
+    name: str
+    ddl: str
+    returns_rows: bool
+
+    @property
+    def version(self) -> str:
+        checksum = hashlib.sha256(self.ddl.encode("utf-8")).hexdigest()[:16]
+        return f"{LIBRARY_VERSION}-{checksum}"
+
+
+def render_function(name: str, builder) -> SqlFunction:
+    """Turn a DO-block builder into a `CREATE OR REPLACE FUNCTION` statement."""
+    sql = builder(**_PLACEHOLDERS)
+    for placeholder, argument in _ARGUMENTS.items():
+        sql = sql.replace(f"'{placeholder}'", argument)
+    leftover = [p for p in _ARGUMENTS if p in sql]
+    if leftover:
+        raise ValueError(f"{name}: unquoted placeholders {leftover} cannot be bound as arguments")
+
+    m = _DO_BLOCK_RE.search(sql)
+    if not m:
+        raise ValueError(f"{name}: builder does not produce a DO block")
+    block = m.group("block").strip()
+    tail = m.group("tail").strip().rstrip(";").strip()
+
+    end = _BLOCK_END_RE.search(block)
+    if not end:
+        raise ValueError(f"{name}: DO block does not end with END")
+    body = block[:end.start()].rstrip()
+
+    returns_rows = bool(tail)
+    if returns_rows:
+        select, order_by, limit = _split_order_by(tail)
+        body += (
+            _RETURN_ROWS
+            .replace("__select__", select)
+            .replace("__over__", f"ORDER BY {order_by}".replace("'", "''") if order_by else "")
+            .replace("__limit__", f" LIMIT {limit}" if limit else "")
+        )
+
+    ddl = (
+        # Dropped first: CREATE OR REPLACE cannot change the return type of an older version
+        f"DROP FUNCTION IF EXISTS {name}({SIGNATURE});\n"
+        f"CREATE OR REPLACE FUNCTION {name}({SIGNATURE})\n"
+        f"RETURNS {'SETOF json' if returns_rows else 'void'}\n"
+        f"LANGUAGE plpgsql\n"
+        # The trailing SELECT now runs inside the function, next to the DO block's
+        # variables; let column names win as they did when it ran on its own.
+        f"AS $rmc$\n#variable_conflict use_column\n{body}\nEND\n$rmc$;"
+    )
+    return SqlFunction(name=name, ddl=ddl, returns_rows=returns_rows)
+
+
+@lru_cache(maxsize=1)
+def library() -> Dict[str, SqlFunction]:
+    """Every function data_layer can delegate to, keyed by function name."""
+    from src.data_layer import PERFORMANCE_MONITOR_SECTIONS, WORKING_SETS
+
+    functions: Dict[str, SqlFunction] = {}
+    for entry in list(WORKING_SETS.values()) + list(PERFORMANCE_MONITOR_SECTIONS.values()):
+        if entry.function:
+            functions[entry.function] = render_function(entry.function, entry.query)
+    return functions
+
+
+def function_call(name: str):
+    """Query text and bind parameters builder for calling an installed function."""
+    fn = library()[name]
+    if fn.returns_rows:
+        query = f"SELECT row_json FROM {name}(:property_id, :property_code, :as_of) AS t(row_json)"
+    else:
+        query = f"SELECT {name}(:property_id, :property_code, :as_of)"
+
+    def params(PROPERTY_ID, PROPERTY_CODE, AS_OF_DATE, start_date, end_date):
+        return {"property_id": PROPERTY_ID, "property_code": PROPERTY_CODE, "as_of": AS_OF_DATE}
+
+    return query, params
+
+
+def unwrap_rows(rows: List[Dict]) -> List[Dict]:
+    """Function results come back as one json object per row."""
+    return [row["row_json"] for row in rows]
+
+
+# -----------------------------------------------------------------------------
+# Installed version lookup
+# -----------------------------------------------------------------------------
+_installed_cache: Dict[tuple, tuple] = {}
+_installed_lock = threading.Lock()
+
+
+def _database_key(conn) -> tuple:
+    url = conn.engine.url
+    return (url.host, url.port, url.database)
+
+
+def read_installed_versions(conn) -> Dict[str, str]:
+    exists = conn.execute(text(f"SELECT to_regclass('{VERSIONS_TABLE}') IS NOT NULL")).scalar()
+    if not exists:
+        return {}
+    rows = conn.execute(text(f"SELECT function_name, version FROM {VERSIONS_TABLE}")).fetchall()
+    return {name: version for name, version in rows}
+
+
+def installed_functions(conn) -> Dict[str, str]:
+    """
+    Functions installed on `conn`'s database whose version matches the code.
+    Cached per database for INSTALLED_CACHE_TTL seconds; lookup errors mean "none".
+    """
+    try:
+        key = _database_key(conn)
+    except Exception:
+        return {}
+    now = time.monotonic()
+    with _installed_lock:
+        cached = _installed_cache.get(key)
+        if cached and now - cached[0] < INSTALLED_CACHE_TTL:
+            return cached[1]
+
+    try:
+        # Savepoint so a failed lookup doesn't abort the caller's transaction
+        with conn.begin_nested():
+            installed = read_installed_versions(conn)
+    except Exception as e:
+        logger.warning(f"Could not read {VERSIONS_TABLE} on {key[2]}: {e}")
+        installed = {}
+
+    current = {name: fn.version for name, fn in library().items()}
+    usable = {name: v for name, v in installed.items() if current.get(name) == v}
+    with _installed_lock:
+        _installed_cache[key] = (now, usable)
+    return usable
+
+
+def forget_installed(conn=None) -> None:
+    """Drop cached version lookups (one database, or all of them)."""
+    with _installed_lock:
+        if conn is None:
+            _installed_cache.clear()
+        else:
+            _installed_cache.pop(_database_key(conn), None)
+
+
+# -----------------------------------------------------------------------------
+# Installer
+# -----------------------------------------------------------------------------
+def install(conn, force: bool = False, only: Optional[List[str]] = None) -> Dict[str, str]:
+    """
+    Create or replace outdated functions on `conn`'s database and record their
+    versions. Returns {function_name: action} with action in installed/up-to-date.
+    """
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} (
+            function_name text PRIMARY KEY,
+            version text NOT NULL,
+            installed_at timestamptz NOT NULL DEFAULT now()
+        )"""))
+    installed = read_installed_versions(conn)
+
+    actions: Dict[str, str] = {}
+    for name, fn in library().items():
+        if only and name not in only:
+            continue
+        if not force and installed.get(name) == fn.version:
+            actions[name] = "up-to-date"
+            continue
+        conn.execute(text(fn.ddl))
+        conn.execute(
+            text(f"""
+                INSERT INTO {VERSIONS_TABLE} (function_name, version, installed_at)
+                VALUES (:name, :version, now())
+                ON CONFLICT (function_name) DO UPDATE
+                SET version = EXCLUDED.version, installed_at = EXCLUDED.installed_at"""),
+            {"name": name, "version": fn.version},
+        )
+        actions[name] = "installed"
+    conn.commit()
+    forget_installed(conn)
+    return actions
+
+
+def status(conn) -> Dict[str, tuple]:
+    """{function_name: (expected_version, installed_version or None)}"""
+    installed = read_installed_versions(conn)
+    return {name: (fn.version, installed.get(name)) for name, fn in library().items()}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Manage the rmc_* SQL function library on property databases.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for command in ("install", "status"):
+        p = sub.add_parser(command)
+        p.add_argument("--property-code", action="append", required=True, help="Property database (repeatable)")
+        p.add_argument("--client-id", default="")
+        if command == "install":
+            p.add_argument("--force", action="store_true", help="Reinstall even when versions match")
+            p.add_argument("--function", action="append", help="Only this function (repeatable)")
+    p = sub.add_parser("render")
+    p.add_argument("--function", action="append", help="Only this function (repeatable)")
+    args = parser.parse_args(argv)
+
+    if args.command == "render":
+        for name, fn in library().items():
+            if not args.function or name in args.function:
+                print(f"-- {name} version {fn.version}\n{fn.ddl}\n")
+        return 0
+
+    from src.db_config import get_db_connection
+
+    failed = False
+    for property_code in args.property_code:
+        conn = None
+        try:
+            conn = get_db_connection(PROPERTY_DATABASE=property_code, clientId=args.client_id)
+            if args.command == "install":
+                for name, action in install(conn, force=args.force, only=args.function).items():
+                    print(f"{property_code}\t{name}\t{action}")
+            else:
+                for name, (expected, current) in status(conn).items():
+                    state = "ok" if expected == current else ("missing" if current is None else "outdated")
+                    print(f"{property_code}\t{name}\t{state}\t{current or '-'}")
+        except Exception as e:
+            failed = True
+            logger.error(f"{args.command} failed for {property_code}: {e}")
+        finally:
+            if conn is not None:
+                conn.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
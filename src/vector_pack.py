@@ -0,0 +1,378 @@
+# src/vector_pack.py
+"""
+Packed, read-only vector snapshots for serverless cold starts.
+
+On Vercel the filesystem is ephemeral, so a query instance either rebuilds the
+per-property Chroma directories or loads them through Chroma's persistence
+layer on every cold start. `export` instead packs all of a property's
+collections into one versioned `<propertyCode>.rmcpack` file, shipped with the
+deployment. A pack holds, per collection:
+
+- the float32 vector matrix and its squared norms,
+- ids and documents as offset + UTF-8 blob columns,
+- metadata as typed columns (int64 / float64 / bool / str, JSON for anything
+  else), each with a presence mask.
+
+`load_pack` memory-maps the file read-only once and serves every collection as
+a `PackedStore` (a read-only vector_store.NumpyStore) whose arrays are views of
+that mapping: opening costs a header parse, and worker processes share the
+pages through the OS page cache. common.getVectorStore reads from packs in
+VECTOR_PACK_DIR when set.
+
+Usage:
+    python -m src.vector_pack export  --property-code AC32AW [--collection annual_summary] [--out ./vector_packs]
+    python -m src.vector_pack inspect ./vector_packs/AC32AW.rmcpack
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import threading
+from collections.abc import Sequence
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.vector_store import _MISSING, NumpyStore
+from utils.logger import get_custom_logger
+
+logger = get_custom_logger(name="vector_pack")
+
+_MAGIC = b"RMCPACK\x00"
+PACK_FORMAT_VERSION = 1
+PACK_SUFFIX = ".rmcpack"
+# Every block starts on a 64-byte boundary so its view is aligned for NumPy
+_ALIGN = 64
+
+# Collections exported when none are named
+PACK_COLLECTIONS = ("annual_summary", "performance_monitor", "daily_summaries", "reservations")
+
+
+def pack_path(pack_dir: str, propertyCode: str) -> str:
+    return os.path.join(pack_dir, f"{propertyCode}{PACK_SUFFIX}")
+
+
+# -----------------------------------------------------------------------------
+# Writer
+# -----------------------------------------------------------------------------
+class _Blocks:
+    """Arrays laid out back to back, each aligned; offsets are relative to the data section."""
+
+    def __init__(self):
+        self.arrays: List[Tuple[int, np.ndarray]] = []
+        self.size = 0
+
+    def add(self, array: np.ndarray) -> dict:
+        array = np.ascontiguousarray(array)
+        self.size += -self.size % _ALIGN
+        block = {"offset": self.size, "dtype": array.dtype.str, "shape": list(array.shape)}
+        self.arrays.append((self.size, array))
+        self.size += array.nbytes
+        return block
+
+    def add_strings(self, values: List[str]) -> dict:
+        encoded = [v.encode("utf-8") for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return {"offsets": self.add(offsets), "data": self.add(data)}
+
+
+def _column_type(values: list) -> str:
+    if all(isinstance(v, bool) for v in values):
+        return "bool"
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return "int64"
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return "float64"
+    if all(isinstance(v, str) for v in values):
+        return "str"
+    return "json"
+
+
+def _add_column(blocks: _Blocks, metadatas: List[dict], key: str) -> dict:
+    present = np.array([key in m for m in metadatas], dtype=np.uint8)
+    values = [m[key] for m in metadatas if key in m]
+    kind = _column_type(values)
+    column = {"type": kind, "present": blocks.add(present)}
+    # Absent rows get a placeholder so row i of the column is document i
+    full = [m.get(key) for m in metadatas]
+    if kind == "bool":
+        column["values"] = blocks.add(np.array([bool(v) for v in full], dtype=np.uint8))
+    elif kind == "int64":
+        column["values"] = blocks.add(np.array([v or 0 for v in full], dtype=np.int64))
+    elif kind == "float64":
+        column["values"] = blocks.add(np.array([v if v is not None else np.nan for v in full], dtype=np.float64))
+    elif kind == "str":
+        column["values"] = blocks.add_strings([v or "" for v in full])
+    else:
+        column["values"] = blocks.add_strings([json.dumps(v, default=str) for v in full])
+    return column
+
+
+def write_pack(path: str, propertyCode: str, collections: Dict[str, dict], embedding_model: Optional[str] = None) -> dict:
+    """
+    Write a pack atomically. `collections` maps a collection name to its
+    Chroma-shaped contents ("ids", "embeddings", "documents", "metadatas").
+    Returns the pack header.
+    """
+    blocks = _Blocks()
+    entries = {}
+    for name, res in collections.items():
+        ids = list(res.get("ids") or [])
+        if ids:
+            matrix = np.asarray(res["embeddings"], dtype=np.float32).reshape(len(ids), -1)
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        metadatas = [m or {} for m in (res.get("metadatas") or [{}] * len(ids))]
+        keys = sorted({k for m in metadatas for k in m})
+        entries[name] = {
+            "count": len(ids),
+            "dim": int(matrix.shape[1]),
+            "vectors": blocks.add(matrix),
+            "norms": blocks.add(np.einsum("ij,ij->i", matrix, matrix).astype(np.float32)),
+            "ids": blocks.add_strings(ids),
+            "documents": blocks.add_strings([d or "" for d in (res.get("documents") or [""] * len(ids))]),
+            "metadata": {key: _add_column(blocks, metadatas, key) for key in keys},
+        }
+
+    header = {
+        "format": "rmc-vector-pack",
+        "version": PACK_FORMAT_VERSION,
+        "property_code": propertyCode,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "embedding_model": embedding_model,
+        "collections": entries,
+    }
+    raw = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    start = len(_MAGIC) + 8 + len(raw)
+    data_start = start + (-start % _ALIGN)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(_MAGIC)
+            f.write(struct.pack("<Q", len(raw)))
+            f.write(raw)
+            for offset, array in blocks.arrays:
+                f.write(b"\x00" * (data_start + offset - f.tell()))
+                f.write(array.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return header
+
+
+def export_pack(propertyCode: str, out_dir: str, collections: Optional[List[str]] = None) -> dict:
+    """Pack the property's collections (from the stores ingest writes) into <out_dir>/<propertyCode>.rmcpack."""
+    from src.common import emb, getVectorStore
+    from src.embedding_cache import model_name
+
+    contents = {}
+    for name in collections or PACK_COLLECTIONS:
+        store = getVectorStore(propertyCode, name, write=True)
+        if not collections and not store.count():
+            continue
+        res = store.get(include=["documents", "metadatas", "embeddings"])
+        contents[name] = res
+        logger.info(f"Packing {len(res.get('ids') or [])} vectors of {propertyCode}/{name}")
+    path = pack_path(out_dir, propertyCode)
+    header = write_pack(path, propertyCode, contents, embedding_model=model_name(emb))
+    logger.info(f"Wrote {path} ({os.path.getsize(path)} bytes, {len(contents)} collections)")
+    return header
+
+
+# -----------------------------------------------------------------------------
+# Loader
+# -----------------------------------------------------------------------------
+class _Strings(Sequence):
+    """Offset + UTF-8 blob column, decoded per item on access."""
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return bytes(self._data[self._offsets[i]:self._offsets[i + 1]]).decode("utf-8")
+
+
+class _Column:
+    def __init__(self, kind: str, present: np.ndarray, values):
+        self.kind = kind
+        self.present = present
+        self.values = values
+
+    def value(self, row: int):
+        v = self.values[row]
+        if self.kind == "bool":
+            return bool(v)
+        if self.kind == "int64":
+            return int(v)
+        if self.kind == "float64":
+            return float(v)
+        if self.kind == "json":
+            return json.loads(v)
+        return v
+
+    def objects(self) -> np.ndarray:
+        """The column as an object array with the store's missing marker in absent rows (for filters)."""
+        out = np.empty(len(self.present), dtype=object)
+        out.fill(_MISSING)
+        for row in np.flatnonzero(self.present):
+            out[row] = self.value(row)
+        return out
+
+
+class _MetadataRows(Sequence):
+    """Row view over the metadata columns: item i is document i's metadata dict."""
+
+    def __init__(self, columns: Dict[str, _Column], count: int):
+        self._columns = columns
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, row: int) -> dict:
+        if row < 0:
+            row += self._count
+        if not 0 <= row < self._count:
+            raise IndexError(row)
+        return {key: c.value(row) for key, c in self._columns.items() if c.present[row]}
+
+
+class PackedStore(NumpyStore):
+    """Read-only NumpyStore over one collection of a memory-mapped pack."""
+
+    def __init__(self, path: str, name: str, entry: dict, buffer: np.ndarray, embeddings=None):
+        self._entry = entry
+        self._buffer = buffer
+        super().__init__(path, embeddings=embeddings, name=name, persist_path=os.path.dirname(path), readonly=True)
+
+    def _block(self, block: dict) -> np.ndarray:
+        dtype = np.dtype(block["dtype"])
+        count = int(np.prod(block["shape"])) if block["shape"] else 1
+        raw = self._buffer[block["offset"]:block["offset"] + count * dtype.itemsize]
+        return raw.view(dtype).reshape(block["shape"])
+
+    def _strings(self, block: dict) -> _Strings:
+        return _Strings(self._block(block["offsets"]), self._block(block["data"]))
+
+    def _load(self) -> None:
+        entry = self._entry
+        self._matrix = self._block(entry["vectors"])
+        self._norms = self._block(entry["norms"])
+        self._ids = list(self._strings(entry["ids"]))
+        self._documents = self._strings(entry["documents"])
+        self._meta_columns = {
+            key: _Column(
+                col["type"],
+                self._block(col["present"]),
+                self._strings(col["values"]) if col["type"] in ("str", "json") else self._block(col["values"]),
+            )
+            for key, col in entry["metadata"].items()
+        }
+        self._metadatas = _MetadataRows(self._meta_columns, entry["count"])
+        self._rows = {doc_id: row for row, doc_id in enumerate(self._ids)}
+        self._columns = {}
+
+    def _refresh(self) -> None:
+        # A pack never changes under a loaded instance
+        pass
+
+    def _column(self, key: str) -> np.ndarray:
+        column = self._columns.get(key)
+        if column is None:
+            source = self._meta_columns.get(key)
+            if source is not None:
+                column = source.objects()
+            else:
+                column = np.empty(len(self._ids), dtype=object)
+                column.fill(_MISSING)
+            self._columns[key] = column
+        return column
+
+
+@dataclass
+class VectorPack:
+    path: str
+    header: dict
+    stores: Dict[str, PackedStore]
+
+    @property
+    def property_code(self) -> str:
+        return self.header["property_code"]
+
+
+def read_pack_header(path: str) -> dict:
+    with open(path, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f"{path} is not a vector pack")
+        (size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(size).decode("utf-8"))
+    if header.get("version") != PACK_FORMAT_VERSION:
+        raise ValueError(f"{path} has pack format version {header.get('version')}, expected {PACK_FORMAT_VERSION}")
+    start = len(_MAGIC) + 8 + size
+    header["_data_start"] = start + (-start % _ALIGN)
+    return header
+
+
+def load_pack(path: str, embeddings=None) -> VectorPack:
+    """Memory-map a pack read-only; `embeddings` embeds the queries of its stores."""
+    header = read_pack_header(path)
+    mapping = np.memmap(path, dtype=np.uint8, mode="r")
+    data = mapping[header["_data_start"]:]
+    stores = {
+        name: PackedStore(path, name, entry, data, embeddings=embeddings)
+        for name, entry in header["collections"].items()
+    }
+    return VectorPack(path=path, header=header, stores=stores)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Export and inspect packed read-only vector snapshots.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("export")
+    p.add_argument("--property-code", action="append", required=True, help="Property to pack (repeatable)")
+    p.add_argument("--collection", action="append", help=f"Only this collection (repeatable, default: the non-empty ones of {', '.join(PACK_COLLECTIONS)})")
+    p.add_argument("--out", default=os.getenv("VECTOR_PACK_DIR") or "./vector_packs", help="Output directory")
+    p = sub.add_parser("inspect")
+    p.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "inspect":
+        header = read_pack_header(args.path)
+        print(f"{args.path}\tversion {header['version']}\t{header['property_code']}\t{header['created_at']}\t{header['embedding_model']}")
+        for name, entry in header["collections"].items():
+            columns = ", ".join(f"{k}:{c['type']}" for k, c in entry["metadata"].items())
+            print(f"  {name}\t{entry['count']} x {entry['dim']}\t{columns}")
+        return 0
+
+    failed = False
+    for property_code in args.property_code:
+        try:
+            header = export_pack(property_code, args.out, collections=args.collection)
+            counts = ", ".join(f"{name}={entry['count']}" for name, entry in header["collections"].items())
+            print(f"{property_code}\t{pack_path(args.out, property_code)}\t{counts}")
+        except Exception as e:
+            failed = True
+            logger.error(f"export failed for {property_code}: {e}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,472 @@
+# src/vector_store.py
+"""
+One vector store API for the agents and ingest, with two backends.
+
+`VectorStore` is the part of Chroma this code base uses: get / upsert / delete /
+count on the collection, similarity search with a Chroma `where` filter, and the
+collection's embedding function.
+
+- `ChromaStore` wraps a langchain Chroma collection (SQLite + HNSW index).
+- `NumpyStore` keeps a whole collection in one `<collection>.vec` file: a JSON
+  header with ids, documents and metadata, followed by a float32 vector matrix
+  and its squared norms that are memory-mapped on open. Search is an exact
+  brute-force dot product. For the few dozen vectors of an annual summary this
+  opens and answers far faster than Chroma's persistence layer.
+
+common.getVectorStore picks the backend (VECTOR_BACKEND, VECTOR_NUMPY_MAX_ROWS).
+
+Usage:
+    python -m src.vector_store bench [--rows 60 --rows 5000] [--dim 1536] [--queries 500]
+    python -m src.vector_store inspect AC32AW/annual_summary.vec
+"""
+import argparse
+import json
+import math
+import operator
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+_MAGIC = b"RMCVEC\x00\x01"
+VEC_FORMAT_VERSION = 1
+# Vector matrix offset alignment inside a .vec file
+_ALIGN = 64
+_MISSING = object()
+
+_COMPARE = {
+    "$eq": operator.eq,
+    "$ne": operator.ne,
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$lt": operator.lt,
+    "$lte": operator.le,
+    "$in": lambda value, arg: value in arg,
+    "$nin": lambda value, arg: value not in arg,
+}
+
+
+def _compare(op: str, value: Any, arg: Any) -> bool:
+    # Like Chroma, a document without the field matches no condition on it
+    if value is _MISSING:
+        return False
+    try:
+        return bool(_COMPARE[op](value, arg))
+    except TypeError:
+        return False
+
+
+# -----------------------------------------------------------------------------
+# Interface
+# -----------------------------------------------------------------------------
+class VectorStore(ABC):
+    """A collection of (id, document, metadata, vector) records."""
+
+    name: str
+    embeddings: Any
+    persist_path: Optional[str] = None
+
+    @abstractmethod
+    def count(self) -> int:
+        ...
+
+    @abstractmethod
+    def get(self, ids: Optional[Sequence[str]] = None, where: Optional[dict] = None, include: Optional[Sequence[str]] = None) -> Dict[str, list]:
+        """Chroma-shaped result: "ids" plus the `include`d "documents" / "metadatas" / "embeddings"."""
+
+    @abstractmethod
+    def upsert(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]], documents: Optional[Sequence[str]] = None, metadatas: Optional[Sequence[dict]] = None) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, ids: Optional[Sequence[str]] = None, where: Optional[dict] = None) -> None:
+        ...
+
+    @abstractmethod
+    def similarity_search_by_vector_with_score(self, embedding: Sequence[float], k: int = 4, filter: Optional[dict] = None) -> List[Tuple[Document, float]]:
+        """The `k` nearest documents with their squared L2 distance (Chroma's default space), nearest first."""
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embeddings.embed_query(query), k=k, filter=filter)
+
+    def similarity_search_with_relevance_scores(self, query: str, k: int = 4, filter: Optional[dict] = None) -> List[Tuple[Document, float]]:
+        # Same mapping langchain applies to Chroma's l2 distances
+        return [(doc, 1.0 - score / math.sqrt(2)) for doc, score in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+
+# -----------------------------------------------------------------------------
+# Chroma backend
+# -----------------------------------------------------------------------------
+class ChromaStore(VectorStore):
+    """VectorStore over a langchain Chroma collection."""
+
+    def __init__(self, chroma, persist_path: Optional[str] = None):
+        self.chroma = chroma
+        self.name = chroma._collection.name
+        self.embeddings = chroma._embedding_function
+        self.persist_path = persist_path
+
+    def count(self) -> int:
+        return self.chroma._collection.count()
+
+    def get(self, ids=None, where=None, include=None) -> Dict[str, list]:
+        kwargs = {"ids": list(ids) if ids is not None else None, "where": where or None}
+        if include is not None:
+            kwargs["include"] = list(include)
+        return self.chroma._collection.get(**kwargs)
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None) -> None:
+        kwargs = {"ids": list(ids), "embeddings": [list(map(float, v)) for v in embeddings]}
+        if documents is not None:
+            kwargs["documents"] = list(documents)
+        if metadatas is not None:
+            kwargs["metadatas"] = list(metadatas)
+        self.chroma._collection.upsert(**kwargs)
+
+    def delete(self, ids=None, where=None) -> None:
+        self.chroma._collection.delete(ids=list(ids) if ids is not None else None, where=where or None)
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None):
+        # langchain's name notwithstanding, this returns distances
+        return self.chroma.similarity_search_by_vector_with_relevance_scores(list(map(float, embedding)), k=k, filter=filter)
+
+    def similarity_search_with_score(self, query, k=4, filter=None):
+        return self.chroma.similarity_search_with_score(query, k=k, filter=filter)
+
+    def similarity_search_with_relevance_scores(self, query, k=4, filter=None):
+        return self.chroma.similarity_search_with_relevance_scores(query, k=k, filter=filter)
+
+
+# -----------------------------------------------------------------------------
+# NumPy backend
+# -----------------------------------------------------------------------------
+def write_vec_file(path: str, ids: Sequence[str], embeddings, documents: Sequence[Optional[str]], metadatas: Sequence[Optional[dict]]) -> None:
+    """
+    Write a .vec file atomically (temp file + rename), so readers that have the
+    old file mapped keep a consistent copy.
+    """
+    ids = list(ids)
+    if ids:
+        matrix = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1))
+    else:
+        matrix = np.zeros((0, 0), dtype=np.float32)
+    header = json.dumps(
+        {
+            "version": VEC_FORMAT_VERSION,
+            "count": len(ids),
+            "dim": int(matrix.shape[1]),
+            "ids": ids,
+            "documents": list(documents),
+            "metadatas": [m or {} for m in metadatas],
+        },
+        ensure_ascii=False,
+        default=str,
+    ).encode("utf-8")
+    start = len(_MAGIC) + 8 + len(header)
+    padding = -start % _ALIGN
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(_MAGIC)
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            f.write(b"\x00" * padding)
+            f.write(matrix.tobytes())
+            f.write(np.einsum("ij,ij->i", matrix, matrix).astype(np.float32).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def read_vec_header(path: str) -> Tuple[dict, int]:
+    """Parsed header of a .vec file and the byte offset of its vector matrix."""
+    with open(path, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f"{path} is not a vector store file")
+        (size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(size).decode("utf-8"))
+    if header.get("version") != VEC_FORMAT_VERSION:
+        raise ValueError(f"{path} has format version {header.get('version')}, expected {VEC_FORMAT_VERSION}")
+    start = len(_MAGIC) + 8 + size
+    return header, start + (-start % _ALIGN)
+
+
+class NumpyStore(VectorStore):
+    """
+    Exact-search VectorStore memory-mapped from a single .vec file. Writes rewrite
+    the whole file, so it is meant for small collections. A file replaced by
+    another process is picked up on the next call.
+    """
+
+    def __init__(self, path: str, embeddings=None, name: Optional[str] = None, persist_path: Optional[str] = None, readonly: bool = False):
+        self.path = path
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self.embeddings = embeddings
+        self.persist_path = persist_path or os.path.dirname(path)
+        self.readonly = readonly
+        self._lock = threading.RLock()
+        self._signature = None
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._signature = None
+            self._ids, self._documents, self._metadatas = [], [], []
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+            self._norms = np.zeros(0, dtype=np.float32)
+            self._rows = {}
+            self._columns = {}
+            return
+        header, offset = read_vec_header(self.path)
+        count, dim = header["count"], header["dim"]
+        if count and dim:
+            self._matrix = np.memmap(self.path, dtype=np.float32, mode="r", offset=offset, shape=(count, dim))
+            self._norms = np.memmap(self.path, dtype=np.float32, mode="r", offset=offset + count * dim * 4, shape=(count,))
+        else:
+            self._matrix = np.zeros((count, dim), dtype=np.float32)
+            self._norms = np.zeros(count, dtype=np.float32)
+        self._ids = header["ids"]
+        self._documents = header["documents"]
+        self._metadatas = header["metadatas"]
+        self._rows = {doc_id: row for row, doc_id in enumerate(self._ids)}
+        self._columns = {}  # metadata key -> object array, built on first filter on it
+        self._signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _refresh(self) -> None:
+        try:
+            st = os.stat(self.path)
+            signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            signature = None
+        if signature != self._signature:
+            self._load()
+
+    def _column(self, key: str) -> np.ndarray:
+        column = self._columns.get(key)
+        if column is None:
+            column = np.empty(len(self._metadatas), dtype=object)
+            column[:] = [m.get(key, _MISSING) for m in self._metadatas]
+            self._columns[key] = column
+        return column
+
+    def _where_mask(self, where: dict) -> np.ndarray:
+        """Rows matching a Chroma `where` filter ($and/$or, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin), evaluated per metadata column."""
+        mask = np.ones(len(self._ids), dtype=bool)
+        for key, cond in where.items():
+            if key == "$and":
+                for c in cond:
+                    mask &= self._where_mask(c)
+            elif key == "$or":
+                mask &= np.logical_or.reduce([self._where_mask(c) for c in cond]) if cond else False
+            else:
+                column = self._column(key)
+                for op, arg in (cond.items() if isinstance(cond, dict) else [("$eq", cond)]):
+                    if op not in _COMPARE:
+                        raise ValueError(f"Unsupported where operator {op}")
+                    mask &= np.frompyfunc(lambda value: _compare(op, value, arg), 1, 1)(column).astype(bool)
+        return mask
+
+    def _select(self, ids=None, where=None) -> List[int]:
+        rows = range(len(self._ids)) if ids is None else [self._rows[i] for i in ids if i in self._rows]
+        if not where:
+            return list(rows)
+        mask = self._where_mask(where)
+        return [r for r in rows if mask[r]]
+
+    def count(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._ids)
+
+    def get(self, ids=None, where=None, include=None) -> Dict[str, list]:
+        include = ("metadatas", "documents") if include is None else include
+        with self._lock:
+            self._refresh()
+            rows = self._select(ids, where)
+            res = {"ids": [self._ids[r] for r in rows]}
+            if "documents" in include:
+                res["documents"] = [self._documents[r] for r in rows]
+            if "metadatas" in include:
+                # Copies: callers (the agents) annotate the metadata they get back
+                res["metadatas"] = [dict(self._metadatas[r]) for r in rows]
+            if "embeddings" in include:
+                res["embeddings"] = np.array(self._matrix[rows]) if rows else []
+            return res
+
+    def _save(self, records: Dict[str, tuple]) -> None:
+        if self.readonly:
+            raise PermissionError(f"Vector store {self.path} is read-only")
+        write_vec_file(
+            self.path,
+            list(records),
+            [r[2] for r in records.values()],
+            [r[0] for r in records.values()],
+            [r[1] for r in records.values()],
+        )
+        self._load()
+
+    def _records(self) -> Dict[str, tuple]:
+        return {doc_id: (self._documents[r], self._metadatas[r], self._matrix[r]) for r, doc_id in enumerate(self._ids)}
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None) -> None:
+        ids = list(ids)
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        documents = list(documents) if documents is not None else [None] * len(ids)
+        metadatas = list(metadatas) if metadatas is not None else [None] * len(ids)
+        with self._lock:
+            self._refresh()
+            if len(self._ids) and vectors.shape[1] != self._matrix.shape[1]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match collection dimension {self._matrix.shape[1]}")
+            records = self._records()
+            for doc_id, vector, doc, meta in zip(ids, vectors, documents, metadatas):
+                records[doc_id] = (doc, meta or {}, vector)
+            self._save(records)
+
+    def delete(self, ids=None, where=None) -> None:
+        with self._lock:
+            self._refresh()
+            if ids is None and not where:
+                return
+            victims = {self._ids[r] for r in self._select(ids, where)}
+            if victims:
+                self._save({doc_id: rec for doc_id, rec in self._records().items() if doc_id not in victims})
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None):
+        query = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._refresh()
+            if not self._ids or k <= 0:
+                return []
+            # |q - x|^2 = |x|^2 - 2 q.x + |q|^2; one pass over the whole matrix is cheaper than gathering the filtered rows
+            distances = self._norms - 2.0 * (self._matrix @ query) + float(query @ query)
+            if filter:
+                mask = self._where_mask(filter)
+                k = min(k, int(mask.sum()))
+                if not k:
+                    return []
+                distances[~mask] = np.inf
+            top = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+            top = top[np.argsort(distances[top], kind="stable")]
+            return [
+                (
+                    Document(page_content=self._documents[r] or "", metadata=dict(self._metadatas[r])),
+                    max(float(distances[r]), 0.0),
+                )
+                for r in top
+            ]
+
+
+# -----------------------------------------------------------------------------
+# Benchmark
+# -----------------------------------------------------------------------------
+def _percentiles(samples: List[float]) -> Tuple[float, float]:
+    p50, p99 = np.percentile(np.asarray(samples) * 1000, [50, 99])
+    return float(p50), float(p99)
+
+
+def _bench_numpy(root: str, ids, vectors, docs, metas, queries, k) -> Dict[str, float]:
+    path = os.path.join(root, "bench.vec")
+    write_vec_file(path, ids, vectors, docs, metas)
+    started = time.perf_counter()
+    store = NumpyStore(path)
+    store.similarity_search_by_vector_with_score(queries[0], k=k)
+    opened = time.perf_counter() - started
+    samples = []
+    for q in queries:
+        t = time.perf_counter()
+        store.similarity_search_by_vector_with_score(q, k=k, filter={"year": {"$eq": 2024}})
+        samples.append(time.perf_counter() - t)
+    return {"open_ms": opened * 1000, **dict(zip(("p50_ms", "p99_ms"), _percentiles(samples)))}
+
+
+def _bench_chroma(root: str, ids, vectors, docs, metas, queries, k) -> Optional[Dict[str, float]]:
+    try:
+        import chromadb
+    except ImportError:
+        return None
+    path = os.path.join(root, "chroma")
+    client = chromadb.PersistentClient(path=path)
+    collection = client.get_or_create_collection("bench")
+    for start in range(0, len(ids), 5000):
+        end = start + 5000
+        collection.upsert(ids=ids[start:end], embeddings=vectors[start:end].tolist(), documents=docs[start:end], metadatas=metas[start:end])
+    # A fresh process-level client so the open pays for SQLite and the HNSW load
+    from chromadb.api.shared_system_client import SharedSystemClient
+    SharedSystemClient.clear_system_cache()
+
+    started = time.perf_counter()
+    collection = chromadb.PersistentClient(path=path).get_collection("bench")
+    collection.query(query_embeddings=[queries[0].tolist()], n_results=k)
+    opened = time.perf_counter() - started
+    samples = []
+    for q in queries:
+        t = time.perf_counter()
+        collection.query(query_embeddings=[q.tolist()], n_results=k, where={"year": {"$eq": 2024}})
+        samples.append(time.perf_counter() - t)
+    SharedSystemClient.clear_system_cache()
+    return {"open_ms": opened * 1000, **dict(zip(("p50_ms", "p99_ms"), _percentiles(samples)))}
+
+
+def bench(rows: int, dim: int = 1536, queries: int = 500, k: int = 5, seed: int = 0) -> Dict[str, Optional[Dict[str, float]]]:
+    """Open time (to first result) and filtered query latency of both backends on `rows` random unit vectors."""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((rows, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [f"doc_{i}" for i in range(rows)]
+    docs = [f"document {i}" for i in range(rows)]
+    metas = [{"year": 2023 + i % 3, "month": i % 12 + 1} for i in range(rows)]
+    query_vectors = rng.standard_normal((queries, dim)).astype(np.float32)
+    root = tempfile.mkdtemp(prefix="vector_bench_")
+    try:
+        return {
+            "numpy": _bench_numpy(root, ids, vectors, docs, metas, query_vectors, k),
+            "chroma": _bench_chroma(root, ids, vectors, docs, metas, query_vectors, k),
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Vector store backends: benchmark and inspect .vec files.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("bench")
+    p.add_argument("--rows", type=int, action="append", help="Collection size (repeatable, default 60 and 5000)")
+    p.add_argument("--dim", type=int, default=1536)
+    p.add_argument("--queries", type=int, default=500)
+    p.add_argument("-k", type=int, default=5)
+    p = sub.add_parser("inspect")
+    p.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "inspect":
+        header, offset = read_vec_header(args.path)
+        print(f"{args.path}\tversion {header['version']}\t{header['count']} vectors x {header['dim']}\tmatrix at byte {offset}")
+        return 0
+
+    print("rows\tbackend\topen_ms\tp50_ms\tp99_ms")
+    for rows in args.rows or [60, 5000]:
+        for backend, res in bench(rows, dim=args.dim, queries=args.queries, k=args.k).items():
+            if res is None:
+                print(f"{rows}\t{backend}\t(not installed)")
+            else:
+                print(f"{rows}\t{backend}\t{res['open_ms']:.2f}\t{res['p50_ms']:.3f}\t{res['p99_ms']:.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+# src/vector_versions.py
+"""
+Versioned collections switched in with an atomic pointer flip.
+
+Ingest builds a new snapshot into a side collection `<collection>__v<UTC stamp>`
+(seeded with a copy of the current version, so incremental and upsert modes keep
+their semantics) and then publishes it by replacing the pointer file
+`<persist_path>/<collection>.current` with os.replace. common.getVectorStore
+resolves the pointer on every open, so a reader sees either the old or the new
+version, never an in-progress ingest, and never waits for one. Builds of one
+collection are serialized by a lock file held from the copy through the flip, so a
+concurrent ingest starts from what the previous one published instead of silently
+overwriting it.
+
+The pointer keeps the superseded versions, newest first. Versions beyond the
+VECTOR_KEEP_VERSIONS most recent (the current one included) are dropped by a
+background thread after each publish; the previous version is kept so queries
+that opened it just before the flip can finish. A collection without a pointer
+is the legacy unversioned collection; the first publish supersedes it.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+from utils.logger import get_custom_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: pointer updates are then only serialized within the process
+    fcntl = None
+
+logger = get_custom_logger(name="vector_versions")
+
+# Versions kept per collection, the current one included. At least 2: the previous
+# version may still be in use by readers that opened it just before the flip.
+VECTOR_KEEP_VERSIONS = max(int(os.getenv("VECTOR_KEEP_VERSIONS", "2")), 2)
+
+_VERSION_MARK = "__v"
+# Chroma's upsert batch ceiling
+_COPY_BATCH = 5000
+_pointer_lock = threading.Lock()
+_collection_locks: Dict[str, threading.Lock] = {}  # lock file path -> in-process lock
+
+
+def pointer_path(persist_path: str, collection_name: str) -> str:
+    return os.path.join(persist_path, f"{collection_name}.current")
+
+
+def new_version_name(collection_name: str) -> str:
+    return f"{collection_name}{_VERSION_MARK}{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')}"
+
+
+def read_pointer(persist_path: str, collection_name: str) -> Optional[dict]:
+    try:
+        with open(pointer_path(persist_path, collection_name), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def current_collection(persist_path: str, collection_name: str) -> str:
+    """The collection readers should open for `collection_name`: its published version, else itself."""
+    if _VERSION_MARK in collection_name:
+        return collection_name
+    try:
+        pointer = read_pointer(persist_path, collection_name)
+    except (OSError, ValueError) as e:
+        logger.error(f"Unreadable version pointer for {collection_name} in {persist_path}: {e}")
+        pointer = None
+    return pointer["current"] if pointer else collection_name
+
+
+@contextmanager
+def _locked(persist_path: str, collection_name: str) -> Iterator[None]:
+    """Serialize builds and pointer read-modify-writes of a collection across threads and processes."""
+    os.makedirs(persist_path, exist_ok=True)
+    path = os.path.join(persist_path, f"{collection_name}.lock")
+    with _pointer_lock:
+        lock = _collection_locks.setdefault(path, threading.Lock())
+    with lock, open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _write_pointer(persist_path: str, collection_name: str, pointer: dict) -> None:
+    path = pointer_path(persist_path, collection_name)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(pointer, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _flip_locked(persist_path: str, collection_name: str, version: str, **info) -> List[str]:
+    pointer = read_pointer(persist_path, collection_name) or {}
+    previous = [pointer.get("current") or collection_name] + list(pointer.get("previous") or [])
+    previous = [v for v in dict.fromkeys(previous) if v != version]
+    _write_pointer(persist_path, collection_name, {
+        "collection": collection_name,
+        "current": version,
+        "previous": previous,
+        "published_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        **info,
+    })
+    return previous[VECTOR_KEEP_VERSIONS - 1:]
+
+
+def flip(persist_path: str, collection_name: str, version: str, **info) -> List[str]:
+    """
+    Atomically point `collection_name` at `version`. Returns the superseded
+    versions past VECTOR_KEEP_VERSIONS, which are now safe to drop.
+    """
+    with _locked(persist_path, collection_name):
+        return _flip_locked(persist_path, collection_name, version, **info)
+
+
+def _forget(persist_path: str, collection_name: str, versions: List[str]) -> None:
+    with _locked(persist_path, collection_name):
+        pointer = read_pointer(persist_path, collection_name)
+        if pointer:
+            pointer["previous"] = [v for v in pointer.get("previous") or [] if v not in versions]
+            _write_pointer(persist_path, collection_name, pointer)
+
+
+def _collect(propertyCode: str, collection_name: str, property_store_dir: Optional[str], persist_path: str, versions: List[str]) -> None:
+    from src.common import drop_vector_store
+
+    dropped = []
+    for version in versions:
+        try:
+            drop_vector_store(propertyCode, version, property_store_dir)
+            dropped.append(version)
+        except Exception as e:
+            # Stays listed in the pointer; the next publish retries it
+            logger.warning(f"Could not drop {version} of {propertyCode}: {e}")
+    if dropped:
+        _forget(persist_path, collection_name, dropped)
+        logger.info(f"Dropped {len(dropped)} superseded versions of {propertyCode}/{collection_name}")
+
+
+def _copy(source, target) -> int:
+    from src.embedding_pipeline import upsert_records
+
+    res = source.get(include=["documents", "metadatas", "embeddings"])
+    ids = res.get("ids") or []
+    for start in range(0, len(ids), _COPY_BATCH):
+        end = start + _COPY_BATCH
+        upsert_records(
+            target,
+            ids[start:end],
+            (res.get("documents") or [None] * len(ids))[start:end],
+            list(res["embeddings"][start:end]),
+            (res.get("metadatas") or [None] * len(ids))[start:end],
+        )
+    return len(ids)
+
+
+@contextmanager
+def building_version(propertyCode: str, collection_name: str, property_store_dir: Optional[str] = None, copy_current: bool = True, **info):
+    """
+    Yield a writable store for a new version of the collection, seeded with a
+    copy of the current version's vectors (no re-embedding). When the block
+    exits cleanly the version is published and superseded versions are
+    garbage-collected in the background; when it raises, the new version is
+    dropped and readers keep the current one.
+
+    The collection's lock is held from the copy through the flip: a second build
+    of the same collection waits, then seeds from the version this one published.
+    """
+    from src.common import drop_vector_store, getVectorStore, property_store_path, refresh_numpy_mirror
+
+    persist_path = property_store_path(propertyCode, property_store_dir)
+    with _locked(persist_path, collection_name):
+        version = new_version_name(collection_name)
+        store = getVectorStore(propertyCode, version, property_store_dir, write=True)
+        try:
+            if copy_current:
+                current = getVectorStore(propertyCode, collection_name, property_store_dir, write=True)
+                copied = _copy(current, store)
+                logger.info(f"Seeded {version} with {copied} vectors of {current.name}")
+            yield store
+            refresh_numpy_mirror(store)
+            superseded = _flip_locked(persist_path, collection_name, version, count=store.count(), **info)
+        except BaseException:
+            logger.error(f"Discarding unpublished version {version} of {propertyCode}/{collection_name}")
+            try:
+                drop_vector_store(propertyCode, version, property_store_dir)
+            except Exception as e:
+                logger.warning(f"Could not drop {version}: {e}")
+            raise
+
+    logger.info(f"Published {version} for {propertyCode}/{collection_name}")
+    if superseded:
+        threading.Thread(
+            target=_collect,
+            args=(propertyCode, collection_name, property_store_dir, persist_path, superseded),
+            name=f"vector-gc-{propertyCode}",
+            daemon=True,
+        ).start()
@@ -0,0 +1,41 @@
+# test_async_performance_monitor.py
+import asyncio
+
+from src.db_config import async_db_available, get_async_engine
+from src.data_layer import get_annual_summary_async, performance_monitor_report_async
+
+property_id = "11"
+property_code = "AC32AW"
+client_id = "7"
+# A string, as the ingest endpoint receives it
+as_of_date = "2025-10-09"
+
+# dashboard_revglance is a DO block (or its rmc_* function), top10marketsegment_drilldown
+# binds the as-of date; highDemandDates also builds the shared demand working set
+sections = ["dashboard_revglance", "top10marketsegment_drilldown", "highDemandDates"]
+
+
+async def main():
+    print("✅ Starting async Performance Monitor test...")
+    if not async_db_available():
+        print("⚠️ sqlalchemy[asyncio] / asyncpg not installed, skipping")
+        return
+
+    engine = await get_async_engine(PROPERTY_DATABASE=property_code, clientId=client_id)
+    async with engine.connect() as conn:
+        report = await performance_monitor_report_async(property_id, property_code, as_of_date, client_id, conn, sections=sections)
+        print("📋 Statuses:", report.statuses)
+        for name in sections:
+            print(f"   {name}: {len((report.payload or {}).get(name, []))} rows")
+        for err in report.error_list:
+            print("❌", err)
+        assert report.payload is not None and set(report.payload) == set(sections), "payload is missing sections"
+        assert all(report.statuses.get(name) in ("ok", "cached") for name in sections), "some sections failed"
+
+        summary, errors = await get_annual_summary_async(property_id, property_code, as_of_date, client_id, conn)
+        assert not errors, errors
+        print("📅 Annual summary rows:", len(summary))
+    print("✅ Async path OK")
+
+
+asyncio.run(main())
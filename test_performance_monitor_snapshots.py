@@ -0,0 +1,57 @@
+# test_performance_monitor_snapshots.py
+import shutil
+
+from src.chroma_ingest import ingest_performance_monitor
+from src.common import getVectorStore, property_store_path
+
+# A throwaway property, so the test never touches real collections
+property_id = "0"
+property_code = "TEST_PM_SNAPSHOTS"
+client_id = "0"
+newer = "2025-10-09"
+older = "2025-10-08"
+
+
+def payload(as_of_date, with_demand=True):
+    # A pre-fetched Performance Monitor payload and its per-section statuses; no database needed
+    rows = {
+        "dashboard_revglance": [{"metric": "Occupancy", "as_of": as_of_date, "value": 81.5}],
+        "highDemandDates": [{"Dates": "2025-10-20", "demand": "High"}] if with_demand else [],
+    }
+    return (rows, []), dict.fromkeys(rows, "ok")
+
+
+def stored(as_of_date, section=None):
+    # The filter performance_monitor_agent queries with
+    flt = {"$and": [
+        {"type": {"$eq": "performance_monitor"}},
+        {"as_of_date": {"$eq": as_of_date}},
+        {"property_code": {"$eq": property_code}},
+    ]}
+    if section:
+        flt["$and"].append({"section": {"$eq": section}})
+    chroma = getVectorStore(property_code, collection_name="performance_monitor", write=True)
+    return chroma.get(where=flt, include=[])["ids"]
+
+
+print("✅ Starting Performance Monitor snapshot test...")
+shutil.rmtree(property_store_path(property_code), ignore_errors=True)
+try:
+    for as_of_date in (newer, older):
+        data, statuses = payload(as_of_date)
+        result = ingest_performance_monitor(PROPERTY_ID=property_id, PROPERTY_CODE=property_code, AS_OF_DATE=as_of_date, CLIENT_ID=client_id, payload=data, statuses=statuses)
+        print(f"📥 Ingested {as_of_date}:", result)
+
+    # Ingesting an older date keeps the newer snapshot and the one just written
+    assert stored(older), f"{older} was deleted right after being ingested"
+    assert stored(newer), f"{newer} was deleted by ingesting an older date"
+
+    # A section that ran fine but now returns no rows loses its stale documents
+    data, statuses = payload(older, with_demand=False)
+    result = ingest_performance_monitor(PROPERTY_ID=property_id, PROPERTY_CODE=property_code, AS_OF_DATE=older, CLIENT_ID=client_id, payload=data, statuses=statuses)
+    print(f"📥 Re-ingested {older} without highDemandDates rows:", result)
+    assert not stored(older, "highDemandDates"), "stale highDemandDates documents were kept"
+    assert stored(older, "dashboard_revglance"), "dashboard_revglance documents were deleted"
+    print("✅ Snapshots OK")
+finally:
+    shutil.rmtree(property_store_path(property_code), ignore_errors=True)